@@ -1,146 +1,610 @@
 from utils import *
 from multiprocessing import Pool
+from functools import partial
 import h5py
 import os
 
 
-## Create the structure containing all the edges and triplets for every time t
-def create_simplicial_framework_from_data(data, null_model_flag):
-    global ts_simplicial
-    # Create the ets and the triplets_ts
-    ts_simplicial = simplicial_complex_mvts(data, null_model_flag)
-    # return(ts_simplicial)
+## Attach, in each Pool worker, the structures built by the main process, one for each group of ROI (read-only views on
+# the shared memory blocks). Without groups, there is only the one of the whole data
+def attach_simplicial_framework(shared_descriptors):
+    global ts_simplicial, ts_groups
+    ts_groups = [attach_shared_simplicial_complex(shared_descriptor) for shared_descriptor in shared_descriptors]
+    ts_simplicial = ts_groups[0]
 
 # This function allows to save on .hd5 file the list of violating triangles when projected at the level of edges.
 # Moreover, it saves on the standard Output several global quantities (line 30):
 # Time; Hyper complexity indic.; Hyper complexity FC; Hyper complexity CT;
 # Hyper complexity FD; Hyper coherence; Average edge violation
-def handle_output(result):
+# (with -d, followed by hyper coherence and average violation of each order from 4 on).
+# For a group of ROI (-g), given as (name, ROI), the line starts with its name and the projection is saved in the
+# folder of the group, with the indices of the ROI of the whole data
+def handle_output(result, group=(None, None)):
     global flag_edgeweight_fn
-    if flag_edgeweight_fn != None:
+    # (the projection is missing for the time points that are not selected with -k)
+    if flag_edgeweight_fn != None and result[-1] is not None:
         f2 = h5py.File('{0}.hd5'.format(flag_edgeweight_fn), 'a')
         current_time = int(result[0])
-        n_lines = len(list(result[-1].items()))
-        c_values = np.array(
-            list(result[-1].items())).flatten().reshape(n_lines, 4)
+        # Rows: [i, j, sum of the weights of the violating triangles, number of violating triangles]
+        c_values = result[-1]
         m, n = np.shape(c_values)
+        if group[0] is not None:
+            c_values = np.column_stack([group[1][c_values[:, :2].astype(int)], c_values[:, 2:]])
         dset1 = f2.create_dataset(
-            "{0}".format(current_time), (m, n), dtype='f', data=c_values)
+            "{0}".format(current_time) if group[0] is None else "{0}/{1}".format(group[0], current_time),
+            (m, n), dtype='f', data=c_values)
         f2.close()
-    print(" ".join([str(el) for el in result[:-1]]))
+    print(" ".join(([group[0]] if group[0] is not None else []) + [str(el) for el in result[:-1]]))
+
+
+# Same as above, for the list of results of a block of time points
+def handle_output_block(results, group=(None, None)):
+    for result in results:
+        handle_output(result, group)
+
+
+# Same as above, in temporal mode (also summing the counters of the vineyard updates)
+def handle_output_block_vineyard(output, group=(None, None)):
+    global vineyard_counters
+    results, counters = output
+    handle_output_block(results, group)
+    vineyard_counters = [total + c for total, c in zip(vineyard_counters, counters)]
 
 
-##Launch the bulk of the code for a single time point
+##Launch one of the functions below (launch, with the arguments args) on the structure of the group of ROI g (-g)
+def launch_code_group(g, launch, args):
+    global ts_simplicial
+    ts_simplicial = ts_groups[g]
+    return(launch(*args))
+
+
+##Launch the bulk of the code for a single time point (the launch_code_* functions use the structure ts_simplicial of
+# the module, attached in the Pool workers or built by the command line)
 def launch_code_one_t(t):
     # Computing the simplicial filtration for the time t
-    list_simplices_positive, list_violation_fully_coherence, hyper_coherence = ts_simplicial.create_simplicial_complex(t)
-    # Computing the persistence diagram using cechmate
-    dgms1 = compute_persistence_diagram_cechmate(list_simplices_positive)
-    # Maximum value that will be used to replace the inf term (important for the WS distance)
-    max_filtration_weight = ts_simplicial.find_max_weight(t)
-    # Replace the inf value of the persistence diagram with maximum weight
-    dgms1_clean = clean_persistence_diagram_cechmate(
-        dgms1, max_filtration_weight)
-    # dict_file = 'PD_{0}.pck'.format(t)
-    # pk.dump(dgms1_clean,open(dict_file,'wb'))
-
-    # Computing the hyper-complexity indicator as the Wasserstein distance with the empty space
-    hyper_complexity = persim.sliced_wasserstein(dgms1_clean, np.array([]))
-
-    # Since the signs of the persistence diagram are flipped,
-    # then Fully Coherent contributes identify points with birth and death <=0
-    dgms1_complexity_FC = dgms1_clean[(dgms1_clean[:, 0] < 0) & (dgms1_clean[:, 1] <= 0)]
-    # Coherent Transition contributes identify points with birth < 0 and death > 0
-    dgms1_complexity_CT = dgms1_clean[(dgms1_clean[:, 0] < 0) & (dgms1_clean[:, 1] > 0)]
-    # Fully Decoherence contributes identify points with birth > 0 and death > 0
-    dgms1_complexity_FD = dgms1_clean[( dgms1_clean[:, 0] > 0) & (dgms1_clean[:, 1] > 0)]
-
-    # Computing the Wasserstein distances
-    complexity_FC = persim.sliced_wasserstein(dgms1_complexity_FC, np.array([]))
-    complexity_CT = persim.sliced_wasserstein(dgms1_complexity_CT, np.array([]))
-    complexity_FD = persim.sliced_wasserstein(dgms1_complexity_FD, np.array([]))
-
-    flag_violations_list = np.array(list_violation_fully_coherence, dtype="object")[:, 2]
-    # Average edge violation
-    avg_edge_violation = np.mean(flag_violations_list)
-
-    n_ROI = ts_simplicial.num_ROI
-    # From the magnitude of the list of violating triangles $\Delta_v$,
-    # we compute the downward projection at the level of edges
-    edge_weights = compute_edgeweight(list_violation_fully_coherence, n_ROI)
+    return(compute_indicators_one_t(ts_simplicial, t, *ts_simplicial.create_simplicial_complex(t)))
+
+
+##Launch the bulk of the code for a block of contiguous time points [t_init, t_end):
+# the weights and the violations are computed for the whole block, then each time point goes through the persistent homology
+def launch_code_block(t_init, t_end):
+    results = []
+    for t, simplicial_complex in zip(range(t_init, t_end), ts_simplicial.create_simplicial_complex_block(t_init, t_end)):
+        results.append(compute_indicators_one_t(ts_simplicial, t, *simplicial_complex))
+    return(results)
+
+
+##Launch the code for a block of contiguous time points in temporal mode: the persistence diagram of each time point is
+# updated from the one of the previous time point with vineyard transpositions when they are cheaper than a reduction
+# (and not more than max_transpositions), otherwise recomputed (see persistence_vineyard). It also returns the counters [time points, vineyard updates, fallbacks, transpositions]
+def launch_code_block_vineyard(t_init, t_end, max_transpositions):
+    vineyard = persistence_vineyard(ts_simplicial.num_ROI, ts_simplicial.ets_vertices, ts_simplicial.triplets_edges,
+                                    max_transpositions, ts_simplicial.compute_persistence_diagram, t_end - t_init)
+    results = []
+    for t, simplicial_complex in zip(range(t_init, t_end), ts_simplicial.create_simplicial_complex_block(t_init, t_end)):
+        results.append(compute_indicators_one_t(ts_simplicial, t, *simplicial_complex, vineyard=vineyard))
+    return(results, [vineyard.n_frames, vineyard.n_updates, vineyard.n_fallbacks, vineyard.n_transpositions])
+
+
+##Launch the first pass of the selection (-k) for a block of contiguous time points [t_init, t_end): only the hyper
+# coherence and the average edge violation, in the same format of the results of compute_indicators_one_t
+def launch_code_coherence_block(t_init, t_end):
+    hyper_coherence, avg_edge_violation = ts_simplicial.compute_coherence_block(t_init, t_end)
+    return([[t, np.nan, np.nan, np.nan, np.nan, hyper_coherence[c], avg_edge_violation[c]] + higher_order_nan() + [None]
+            for c, t in enumerate(range(t_init, t_end))])
+
+
+# Columns of the orders from 4 on (with -d) for the time points whose indicators are not computed
+def higher_order_nan():
+    return([np.nan] * 2 * (ts_simplicial.max_order - 3))
+
+##Compute the higher-order indicators of the time t of the structure ts_simplicial, starting from its simplicial filtration
+# (the structure is passed explicitly, so that several engines can be iterated at the same time)
+# (label is the time written in the output, if different from t, e.g. in streaming mode)
+def compute_indicators_one_t(ts_simplicial, t, filtration, list_violation_fully_coherence, hyper_coherence, vineyard=None,
+                             label=None):
+    # Hyper-complexity indicators (skipped, and reported as nan, if not among the outputs)
+    hyper_complexity = complexity_FC = complexity_CT = complexity_FD = np.nan
+    if 'complexity' in ts_simplicial.outputs:
+        # Computing the persistence diagram (H1 only, same output as cechmate),
+        # in temporal mode updating the one of the previous time point
+        if ts_simplicial.sparse is not None:
+            # Approximate sparse mode: only part of the triangles enter the filtration
+            n_triangles = len(filtration[0]) - ts_simplicial.num_ROI - len(ts_simplicial.ets_vertices)
+            filtration, n_dropped, cutoff = ts_simplicial.sparsify_filtration(filtration)
+        if vineyard is None:
+            dgms1 = ts_simplicial.compute_persistence_diagram(filtration)
+        else:
+            dgms1 = vineyard.compute_persistence_diagram(filtration)
+        # Maximum value that will be used to replace the inf term (important for the WS distance)
+        max_filtration_weight = ts_simplicial.find_max_weight(t)
+        # Replace the inf value of the persistence diagram with maximum weight
+        dgms1_clean = clean_persistence_diagram_cechmate(
+            dgms1, max_filtration_weight)
+        # dict_file = 'PD_{0}.pck'.format(t)
+        # pk.dump(dgms1_clean,open(dict_file,'wb'))
+
+        # Computing the hyper-complexity indicator as the Wasserstein distance with the empty space, for the whole
+        # diagram and for its Fully Coherent, Coherent Transition and Fully Decoherence contributions (one projection
+        # for all, or the exact distance of order ts_simplicial.wasserstein_order)
+        hyper_complexity, complexity_FC, complexity_CT, complexity_FD = \
+            compute_hyper_complexity(dgms1_clean, order=ts_simplicial.wasserstein_order)
+
+        if ts_simplicial.sparse is not None:
+            # The exact hyper complexity is between the lower bound and the value of the sparse filtration, while hyper
+            # coherence and average edge violation are computed on all the triangles (exact)
+            lower_bound = hyper_complexity_lower_bound(dgms1_clean, min(cutoff, max_filtration_weight),
+                                                       ts_simplicial.wasserstein_order)
+            sys.stderr.write("[sparse] t={0}: dropped {1} of {2} triangles, hyper complexity {3} >= {4} (error <= {5}), "
+                             "hyper coherence exact\n".format(t, n_dropped, n_triangles, hyper_complexity, lower_bound,
+                                                              hyper_complexity - lower_bound))
+
+    if ts_simplicial.large_N:
+        # In large-N mode the violations are already reduced, while streaming the triangles
+        avg_edge_violation, edge_weights = list_violation_fully_coherence
+    else:
+        # Average edge violation (list_violation_fully_coherence[2] is the number of missing edges of each violating triangle)
+        avg_edge_violation = np.mean(list_violation_fully_coherence[2])
+
+        n_ROI = ts_simplicial.num_ROI
+        # From the magnitude of the list of violating triangles $\Delta_v$,
+        # we compute the downward projection at the level of edges (if among the outputs)
+        edge_weights = None
+        if 'dv' in ts_simplicial.outputs:
+            edge_weights = compute_edgeweight(list_violation_fully_coherence, n_ROI, ts_simplicial.backend)
 
     # Report the results in a vector and print everything
     # (except the downward projections) on standard Output
-    results = [t, hyper_complexity, complexity_FC, complexity_CT,
-               complexity_FD, hyper_coherence, avg_edge_violation, edge_weights]
+    # Hyper coherence and average violation of the orders from 4 on (with -d)
+    higher_order_coherence = []
+    if ts_simplicial.max_order > 3:
+        higher_order_coherence = ts_simplicial.compute_higher_order_coherence(t)
+
+    results = [t if label is None else label, hyper_complexity, complexity_FC, complexity_CT,
+               complexity_FD, hyper_coherence, avg_edge_violation] + higher_order_coherence + [edge_weights]
 
     return(results)
 
+##Streaming mode (-q): computes the frames of the series one at a time while they are read (from the file path_file,
+# followed while it grows, or from the standard input '-'). The first warmup frames initialise the statistics and are
+# computed as usual, then each frame updates the running statistics (over the last window frames, or the whole history
+# with window 0) and its line is printed as soon as it is computed
+def launch_code_stream(path_file, warmup, window, memory_budget, dtype, large_N, max_order, attributes):
+    global ts_simplicial
+    frames = stream_frames(path_file, dtype)
+    warmup_frames = list(itertools.islice(frames, warmup))
+    if len(warmup_frames) < warmup:
+        raise ValueError("The streaming mode (-q) needs {0} warm-up frames, only {1} were read".format(warmup, len(warmup_frames)))
+    ts_simplicial = simplicial_complex_stream(np.transpose(warmup_frames), window, memory_budget, dtype, large_N, max_order)
+    if attributes['sparse'] is not None:
+        check_sparse(attributes['sparse'], len(ts_simplicial.ets_vertices))
+    ts_simplicial.__dict__.update(attributes)
+    for t in range(warmup):
+        handle_output(launch_code_one_t(t))
+        sys.stdout.flush()
+    for t, frame in enumerate(frames, start=warmup):
+        ts_simplicial.add_frame(frame)
+        handle_output(compute_indicators_one_t(ts_simplicial, 0, *ts_simplicial.create_simplicial_complex(0), label=t))
+        sys.stdout.flush()
 
-############# MAIN CODE #############
-if len(sys.argv) <= 1:
-    print(
-        "******************************************************************************\n"
-        "**                                                                          **\n"
-        "**              Computation of the higher-order indicators                  **\n"
-        "**               starting from a multivariate time series                   **\n"
-        "**                                                                          **\n"
-        "**                                                                          **\n"
-        "**  <filename_multivariate_series> file containing the multiv. time series  **\n"
-        "**                         Format currently accepted:                       **\n"
-        "**        .txt:  where columns represents the independent time series       **\n"
-        "**        .mat:  where rows are ROI, and columns are the time instants      **\n"
-        "**                                                                          **\n"
-        "**                                                                          **\n"
-        "**                     ----   Optional Variables  ----                      **\n"
-        "**                                                                          **\n"
-        "**    <-t t0 T> restricts the Output of the higher-order indicators         **\n"
-        "**                  only for the time interval [t0,T]                       **\n"
-        "**                                                                          **\n"
-        "**   <-p #core> represents the number of cores used for the computation of  **\n"
-        "**                     the higher-order indicators                          **\n"
-        "**                                                                          **\n"
-        "**     <-n > computes the higher-order indicators for the null model        **\n"
-        "**           constructed by independently reshuffling each signal           **\n"
-        "**                                                                          **\n"
-        "**   <-s <filename>> saves on filename.hdf5 the weighted network obtained   **\n"
-        "**    when projecting the magnitude of the list of violations on a graph    **\n"
-        "**                                                                          **\n"
-        "**      OUTPUT: by default the algorithm returns the following info:        **\n"
-        "** Time; Hyper complexity indic.; Hyper complexity FC; Hyper complexity CT; **\n"
-        "**        Hyper complexity FD; Hyper coherence; Average edge violation      **\n"
-        "**                                                                          **\n"
-        "******************************************************************************\n"
-        "Usage: %s <filename_multivariate_series>   [-t t0 T] [-p #core] [-n] [-s <filename>]\n\n" % sys.argv[0]);
-    exit(1)
 
+## Library API: the computation of the higher-order indicators from another script or a notebook (in the same process),
+# without the command line. The options are the ones of the command line (ENGINE_OPTIONS, with their defaults), and
+# the frames are computed lazily, block after block, as dictionaries (frame_result):
+#     engine = higher_order_engine('../Input/subject1_left.txt', {'max_order': 4, 'threads': 4})
+#     for frame in engine.iter_frames(range(100)):
+#         print(frame['time'], frame['hyper_coherence'])
+#     results = engine.run(parallel=8)
+#     engine.close()
+ENGINE_OPTIONS = {'null_model': False,           # -n
+                  'seed': None,                  # -r
+                  'memory_budget': DEFAULT_MEMORY_BUDGET,  # -m
+                  'memory_report': False,        # (reports the peak of the precomputation on stderr, as with -m)
+                  'dtype': np.float64,           # -f
+                  'cache_dir': None,             # -c
+                  'block_size': 1,               # -b
+                  'max_transpositions': None,    # -v
+                  'wasserstein_order': None,     # -w
+                  'outputs': 'complexity',       # -o
+                  'large_N': False,              # -l
+                  'sparse': None,                # -x
+                  'max_order': 3,                # -d
+                  'backend': 'numpy',            # -e
+                  'threads': 1}                  # -i
+
+# Names of the indicators of a frame, in the order of the columns of the output (then, with max_order > 3, the hyper
+# coherence and the average number of missing faces of each order, see frame_result)
+INDICATOR_NAMES = ['time', 'hyper_complexity', 'hyper_complexity_FC', 'hyper_complexity_CT', 'hyper_complexity_FD',
+                   'hyper_coherence', 'avg_edge_violation']
+
+
+# Function that returns the results of a frame (as returned by compute_indicators_one_t) as a dictionary: the indicators
+# of INDICATOR_NAMES, 'hyper_coherence_<k>' and 'avg_missing_faces_<k>' for the orders k from 4 on (-d), and
+# 'edge_weights' with the projection of the violations on the edges (None if not computed)
+def frame_result(result):
+    frame = dict(zip(INDICATOR_NAMES, result[:len(INDICATOR_NAMES)]))
+    higher_order_coherence = result[len(INDICATOR_NAMES):-1]
+    for c in range(0, len(higher_order_coherence), 2):
+        k = 4 + c // 2
+        frame['hyper_coherence_{0}'.format(k)] = higher_order_coherence[c]
+        frame['avg_missing_faces_{0}'.format(k)] = higher_order_coherence[c + 1]
+    frame['edge_weights'] = result[-1]
+    return(frame)
+
+
+class higher_order_engine():
+    # data is the path of a file of the multivariate time series (see load_data) or an array (ROI x time points),
+    # options a dictionary with some of the keys of ENGINE_OPTIONS, and rois the indices of the ROI of a group (-g)
+    def __init__(self, data, options=None, rois=None):
+        unknown = set(options or {}) - set(ENGINE_OPTIONS)
+        if unknown:
+            raise ValueError("Unknown options {0}: use some of {1}".format(', '.join(sorted(unknown)), ', '.join(ENGINE_OPTIONS)))
+        self.options = dict(ENGINE_OPTIONS, **(options or {}))
+        self.check_options()
+        dtype = np.dtype(self.options['dtype']).type
+        if isinstance(data, str):
+            data = load_data(data, dtype)
+        self.ts_simplicial = simplicial_complex_mvts(np.asarray(data, dtype=dtype), self.options['null_model'],
+                                                     self.options['memory_budget'], dtype, self.options['cache_dir'],
+                                                     self.options['seed'], self.options['large_N'],
+                                                     self.options['max_order'], rois)
+        if self.options['memory_report']:
+            self.ts_simplicial.report_precompute_memory()
+        if self.ts_simplicial.subset_cache_path is not None:
+            self.ts_simplicial.report_subset_cache()
+        self.ts_simplicial.wasserstein_order = self.options['wasserstein_order']
+        self.ts_simplicial.outputs = OUTPUT_MODES[self.options['outputs']]
+        if self.options['sparse'] is not None:
+            check_sparse(self.options['sparse'], len(self.ts_simplicial.ets_vertices))
+        self.ts_simplicial.sparse = self.options['sparse']
+        self.ts_simplicial.backend = self.options['backend']
+        self.ts_simplicial.threads = self.options['threads']
+        self.num_frames = self.ts_simplicial.T
+        self.shared_descriptor = None
+        # [time points, vineyard updates, fallbacks to full reduction, transpositions] of the temporal mode
+        self.vineyard_counters = [0, 0, 0, 0]
+
+    # Function that checks the options, with the same rules of the command line (the options without effect with the
+    # chosen outputs are dropped, the ones that cannot be combined raise an error)
+    def check_options(self):
+        options = self.options
+        if options['outputs'] not in OUTPUT_MODES:
+            raise ValueError("Unknown outputs '{0}': use one of {1}".format(options['outputs'], ', '.join(OUTPUT_MODES)))
+        if options['backend'] not in KERNEL_BACKENDS:
+            raise ValueError("Unknown backend '{0}': use one of {1}".format(options['backend'], ', '.join(KERNEL_BACKENDS)))
+        if options['sparse'] is not None:
+            check_sparse(options['sparse'])
+        if options['max_order'] < 3:
+            raise ValueError("The maximum order must be at least 3, not {0}".format(options['max_order']))
+        if options['wasserstein_order'] is not None and not options['wasserstein_order'] >= 1:
+            raise ValueError("The order of the Wasserstein distance must be at least 1, not {0}".format(options['wasserstein_order']))
+        if 'complexity' not in OUTPUT_MODES[options['outputs']]:
+            # No persistence diagram to follow in time, nor filtration to sparsify
+            options['max_transpositions'] = options['sparse'] = None
+        if options['large_N'] and (options['sparse'] is not None or options['max_transpositions'] is not None):
+            raise ValueError("The approximate sparse mode and the temporal mode are not available in large-N mode")
+        if options['sparse'] is not None and options['max_transpositions'] is not None:
+            raise ValueError("The temporal mode is not available in the approximate sparse mode")
+        if options['backend'] == 'numba' and numba is None:
+            sys.stderr.write("numba is not installed: the numpy backend is used instead\n")
+            options['backend'] = 'numpy'
+
+    # Generator of the results of the time points of t_list (default: all), in order and one at a time: the weights and
+    # the violations are computed for blocks of block_size contiguous time points, and in temporal mode the persistence
+    # diagram follows the time points of t_list
+    def iter_frames(self, t_list=None):
+        t_list = list(range(self.num_frames) if t_list is None else t_list)
+        vineyard = None
+        if self.options['max_transpositions'] is not None:
+            vineyard = persistence_vineyard(self.ts_simplicial.num_ROI, self.ts_simplicial.ets_vertices,
+                                            self.ts_simplicial.triplets_edges, self.options['max_transpositions'],
+                                            self.ts_simplicial.compute_persistence_diagram, len(t_list))
+        try:
+            for t_block in contiguous_blocks(t_list, self.options['block_size']):
+                for t, simplicial_complex in zip(t_block, self.ts_simplicial.create_simplicial_complex_block(t_block[0], t_block[-1] + 1)):
+                    yield(frame_result(compute_indicators_one_t(self.ts_simplicial, t, *simplicial_complex, vineyard=vineyard)))
+        finally:
+            if vineyard is not None:
+                self.vineyard_counters = [total + c for total, c in zip(self.vineyard_counters, [
+                    vineyard.n_frames, vineyard.n_updates, vineyard.n_fallbacks, vineyard.n_transpositions])]
+
+    # Function that returns the list of the results of the time points of t_list (default: all), in order. With
+    # parallel > 1 the blocks of time points are computed by a Pool of processes, which attach the arrays of the engine
+    # in shared memory (published at the first parallel run, and kept until close). In temporal mode each process
+    # follows one block of contiguous time points (by default, one block per process)
+    def run(self, t_list=None, parallel=1):
+        if parallel <= 1:
+            return(list(self.iter_frames(t_list)))
+        t_list = list(range(self.num_frames) if t_list is None else t_list)
+        if self.shared_descriptor is None:
+            self.shared_descriptor = self.ts_simplicial.share_memory()
+        block_size = self.options['block_size']
+        if self.options['max_transpositions'] is not None and block_size == 1:
+            block_size = int(np.ceil(len(t_list) / parallel))
+        t_blocks = [(t_block[0], t_block[-1] + 1) for t_block in contiguous_blocks(t_list, block_size)]
+        with Pool(processes=parallel, initializer=attach_simplicial_framework, initargs=([self.shared_descriptor],)) as pool:
+            if self.options['max_transpositions'] is None:
+                outputs = pool.starmap(launch_code_block, t_blocks)
+            else:
+                outputs = []
+                for results, counters in pool.starmap(launch_code_block_vineyard, [
+                        t_block + (self.options['max_transpositions'],) for t_block in t_blocks]):
+                    outputs.append(results)
+                    self.vineyard_counters = [total + c for total, c in zip(self.vineyard_counters, counters)]
+        return([frame_result(result) for results in outputs for result in results])
 
+    # Function that frees the shared memory blocks of the parallel runs (the engine cannot be used afterwards)
+    def close(self):
+        if self.shared_descriptor is not None:
+            self.ts_simplicial.release_shared_memory()
+            self.shared_descriptor = None
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+############# MAIN CODE #############
 if __name__ == "__main__":
+    if len(sys.argv) <= 1:
+        print(
+            "******************************************************************************\n"
+            "**                                                                          **\n"
+            "**              Computation of the higher-order indicators                  **\n"
+            "**               starting from a multivariate time series                   **\n"
+            "**                                                                          **\n"
+            "**                                                                          **\n"
+            "**  <filename_multivariate_series> file containing the multiv. time series  **\n"
+            "**                         Format currently accepted:                       **\n"
+            "**        .txt:  where columns represents the independent time series       **\n"
+            "**        .mat:  where rows are ROI, and columns are the time instants      **\n"
+            "**                                                                          **\n"
+            "**                                                                          **\n"
+            "**                     ----   Optional Variables  ----                      **\n"
+            "**                                                                          **\n"
+            "**    <-t t0 T> restricts the Output of the higher-order indicators         **\n"
+            "**                  only for the time interval [t0,T]                       **\n"
+            "**                                                                          **\n"
+            "**   <-p #core> represents the number of cores used for the computation of  **\n"
+            "**                     the higher-order indicators                          **\n"
+            "**                                                                          **\n"
+            "**   <-m #MB> memory budget for the precomputation of the edges and         **\n"
+            "**        triplets statistics (default: 1024), reports the peak on stderr   **\n"
+            "**                                                                          **\n"
+            "**   <-f float32> runs the whole computation in single precision, which     **\n"
+            "**        halves the memory (default: float64). See the tolerances in the   **\n"
+            "**        README of this folder                                             **\n"
+            "**                                                                          **\n"
+            "**   <-c <folder>> stores the statistics of edges and triplets in a cache   **\n"
+            "**        folder, a later run on the same input (and options) loads them    **\n"
+            "**        memory-mapped instead of recomputing them                         **\n"
+            "**                                                                          **\n"
+            "**     <-n > computes the higher-order indicators for the null model        **\n"
+            "**           constructed by independently reshuffling each signal           **\n"
+            "**        (<-r #seed> makes the reshuffling reproducible, and cacheable)    **\n"
+            "**                                                                          **\n"
+            "**   <-b #frames> number of contiguous time points processed together by    **\n"
+            "**        each core (default: 1). Larger blocks amortize the products,      **\n"
+            "**        but the memory grows linearly with the block size                 **\n"
+            "**                                                                          **\n"
+            "**   <-v #swaps> temporal mode: each core follows contiguous time points,   **\n"
+            "**        and each persistence diagram is updated from the previous one     **\n"
+            "**        with vineyard transpositions only when the measured costs show    **\n"
+            "**        them cheaper than a new reduction. #swaps is only an upper limit  **\n"
+            "**        of the transpositions: at fMRI sizes (e.g. the inputs of the      **\n"
+            "**        repository) the frames usually all fall back to the reduction of  **\n"
+            "**        the default mode (updates and fallbacks reported on stderr)       **\n"
+            "**                                                                          **\n"
+            "**   <-w #p> hyper complexity as the exact Wasserstein distance of order p  **\n"
+            "**        (p=inf for the bottleneck) instead of the sliced one (default).   **\n"
+            "**        Values are the ones of the Julia code with -w divided by sqrt(2)  **\n"
+            "**                                                                          **\n"
+            "**   <-o <outputs>> computes only some of the outputs (the others are nan): **\n"
+            "**        'coherence' hyper coherence and average edge violation, 'dv' also **\n"
+            "**        the projection of the violations on the edges (-s), 'complexity'  **\n"
+            "**        also the hyper complexity (default)                               **\n"
+            "**                                                                          **\n"
+            "**   <-k <rule> #value> two passes: hyper coherence of all the time points, **\n"
+            "**        then the other outputs only for the selected time points (nan     **\n"
+            "**        for the others): rule 'top' or 'bottom' keeps the fraction #value **\n"
+            "**        with the highest or lowest hyper coherence, 'above' or 'below'    **\n"
+            "**        the time points with hyper coherence >= or <= #value              **\n"
+            "**                                                                          **\n"
+            "**   <-a #stride #tol> adaptive sampling: one time point every #stride,     **\n"
+            "**        then the midpoints of the intervals where any indicator changes   **\n"
+            "**        by more than #tol (relative), until no interval is refined. The   **\n"
+            "**        time points that are skipped are printed with nan indicators      **\n"
+            "**                                                                          **\n"
+            "**   <-l> large-N mode: the triangles are streamed in blocks (size set by   **\n"
+            "**        -m), so the memory of each time point does not depend on their    **\n"
+            "**        number. Same outputs, but -v is not available                     **\n"
+            "**                                                                          **\n"
+            "**   <-x <rule> #value> approximate sparse mode: only the triangles with    **\n"
+            "**        weight above the #value-quantile ('quantile'), or with all the    **\n"
+            "**        edges among the first #value edges ('topk'), enter the            **\n"
+            "**        filtration. Dropped triangles and error bounds on stderr          **\n"
+            "**                                                                          **\n"
+            "**   <-d #order> also the violations of the simplices of order 4 up to      **\n"
+            "**        #order (default 3: triplets only), checked against their faces    **\n"
+            "**                                                                          **\n"
+            "**   <-g <filename>> indicators of groups of ROI (e.g. canonical networks)  **\n"
+            "**        instead of the whole data: one group per line, its name and the   **\n"
+            "**        indices of its ROI (from 0, or ranges first-last). The groups are **\n"
+            "**        computed together, and each line of the output starts with the    **\n"
+            "**        name of its group (-k and -a are not available)                   **\n"
+            "**                                                                          **\n"
+            "**   <-e <backend>> backend of the per-frame kernels: numpy (default) or    **\n"
+            "**        numba (compiled, if numba is installed, otherwise numpy is used)  **\n"
+            "**                                                                          **\n"
+            "**   <-i #threads> threads sharing the weights and the violations of each   **\n"
+            "**        time point (within each of the #core processes of -p)             **\n"
+            "**                                                                          **\n"
+            "**   <-q #warmup #window> streaming mode: the frames are computed one at a  **\n"
+            "**        time while they are read (the file is followed while it grows,    **\n"
+            "**        or '-' for the standard input), with running statistics over the  **\n"
+            "**        last #window frames (0: all), initialised on #warmup frames       **\n"
+            "**                                                                          **\n"
+            "**   <-s <filename>> saves on filename.hdf5 the weighted network obtained   **\n"
+            "**    when projecting the magnitude of the list of violations on a graph    **\n"
+            "**                                                                          **\n"
+            "**      OUTPUT: by default the algorithm returns the following info:        **\n"
+            "** Time; Hyper complexity indic.; Hyper complexity FC; Hyper complexity CT; **\n"
+            "**        Hyper complexity FD; Hyper coherence; Average edge violation      **\n"
+            "**   (with -d, two more columns for each order: hyper coherence and         **\n"
+            "**    average number of missing faces)                                      **\n"
+            "**                                                                          **\n"
+            "******************************************************************************\n"
+            "Usage: %s <filename_multivariate_series>   [-t t0 T] [-p #core] [-b #frames] [-v #swaps] [-w #p] [-o <outputs>] [-k <rule> #value] [-a #stride #tol] [-l] [-x <rule> #value] [-d #order] [-g <filename>] [-e <backend>] [-i #threads] [-q #warmup #window] [-m #MB] [-f float32] [-c <folder>] [-n [-r #seed]] [-s <filename>]\n\n" % sys.argv[0]);
+        exit(1)
+
     # Parsing the input (still to do with the argparse library )
-    [path_file, t_init, t_end, t_total, ncores, null_model_flag,
-        flag_edgeweight, flag_edgeweight_fn] = parse_input(sys.argv)
+    [path_file, t_init, t_end, t_total, ncores, block_size, memory_budget, flag_memory_report, dtype, cache_dir, seed,
+        max_transpositions, wasserstein_order, output_mode, selection, adaptive, large_N, sparse, max_order, groups_file, backend, threads, stream, null_model_flag, flag_edgeweight, flag_edgeweight_fn] = parse_input(sys.argv)
+
+    # Options that have no effect with the chosen outputs (or sampling)
+    if flag_edgeweight_fn != None and 'dv' not in OUTPUT_MODES[output_mode]:
+        sys.stderr.write("The projection of the violations is not computed with -o {0}: -s is ignored\n".format(output_mode))
+        flag_edgeweight_fn = None
+    if max_transpositions != None and 'complexity' not in OUTPUT_MODES[output_mode]:
+        # No persistence diagram to follow in time
+        max_transpositions = None
+    if sparse != None and 'complexity' not in OUTPUT_MODES[output_mode]:
+        # The sparse filtration only changes the hyper complexity
+        sparse = None
+    if large_N and sparse != None:
+        # The triangles are not stored, nor sorted
+        sys.stderr.write("The approximate sparse mode (-x) is not available in large-N mode: -x is ignored\n")
+        sparse = None
+    if sparse != None and max_transpositions != None:
+        # The vineyard follows the whole filtration
+        sys.stderr.write("The temporal mode (-v) is not available in the approximate sparse mode (-x): -v is ignored\n")
+        max_transpositions = None
+    if large_N and max_transpositions != None:
+        # The vineyard needs the whole boundary matrix
+        sys.stderr.write("The temporal mode (-v) is not available in large-N mode: -v is ignored\n")
+        max_transpositions = None
+    if adaptive != None and (selection != None or max_transpositions != None):
+        # The adaptive sampling chooses the time points by itself, one at a time
+        sys.stderr.write("The adaptive sampling (-a) computes one time point at a time: -k and -v are ignored\n")
+        selection = max_transpositions = None
+    if groups_file != None and (selection != None or adaptive != None):
+        # The time points are chosen from the indicators of the whole data
+        sys.stderr.write("The selection of the time points (-k, -a) is not available with groups of ROI (-g): -k and -a are ignored\n")
+        selection = adaptive = None
+    if backend == 'numba' and numba is None:
+        # The compiled kernels are optional, the array operations give the same results
+        sys.stderr.write("numba is not installed: the numpy backend is used instead (-e)\n")
+        backend = 'numpy'
 
     # Empty existing file
     if flag_edgeweight_fn != None:
         f1 = h5py.File("{0}.hd5".format(flag_edgeweight_fn), "w")
         f1.close()
 
+    if stream != None:
+        # The frames are computed one after the other, as they arrive
+        if (t_init, t_end) != (0, 0) or ncores > 1 or block_size > 1 or max_transpositions != None or selection != None or \
+                adaptive != None or groups_file != None or null_model_flag == True or cache_dir != None:
+            sys.stderr.write("The streaming mode (-q) computes the frames one at a time as they arrive: -t, -p, -b, -v, -k, "
+                             "-a, -g, -n and -c are ignored\n")
+        launch_code_stream(path_file, stream[0], stream[1], memory_budget, dtype, large_N, max_order,
+                           {'wasserstein_order': wasserstein_order, 'outputs': OUTPUT_MODES[output_mode], 'sparse': sparse,
+                            'backend': backend, 'threads': threads})
+        exit(0)
+
     # Loading the data from file
-    data_TS = load_data(path_file)
+    data_TS = load_data(path_file, dtype)
 
 
-    # Creating the structure containing the edge and triplet signals within the Pool process.
-    # With this syntax, it shouldn't create problems in OS systems
-    pool = Pool(processes=ncores, initializer=create_simplicial_framework_from_data,
-                initargs=(data_TS, null_model_flag))
+    # Creating the structure containing the edge and triplet signals once, in the main process.
+    # Its arrays are published in shared memory, and the Pool workers attach them without recomputing nor copying them
+    # (with the null model, all the workers also see the same reshuffling).
+    # With -g, one structure for each group of ROI, restricted to its rows of the data (the cost of the statistics grows
+    # as the cube of the number of ROI, so the groups are much cheaper than the whole data). They are built from the
+    # same loaded data, and the time points of all the groups are computed concurrently by the same Pool
+    groups = [(None, None)]
+    if groups_file != None:
+        groups = load_roi_groups(groups_file, np.shape(data_TS)[0], max_order)
+        if null_model_flag == True and seed == None:
+            # All the groups see the same reshuffling of the data (not cached, as without a seed)
+            seed, cache_dir = np.random.randint(2**31), None
+    # (the options are already checked above, the engine only builds the structure of each group)
+    engine_options = {'null_model': null_model_flag, 'seed': seed, 'memory_budget': memory_budget,
+                      'memory_report': flag_memory_report, 'dtype': dtype, 'cache_dir': cache_dir,
+                      'max_transpositions': max_transpositions, 'wasserstein_order': wasserstein_order,
+                      'outputs': output_mode, 'large_N': large_N, 'sparse': sparse, 'max_order': max_order,
+                      'backend': backend, 'threads': threads}
+    ts_groups = [higher_order_engine(data_TS, engine_options, rois).ts_simplicial for name, rois in groups]
+    ts_simplicial = ts_groups[0]
+    shared_descriptors = [ts_group.share_memory() for ts_group in ts_groups]
+    pool = Pool(processes=ncores, initializer=attach_simplicial_framework, initargs=(shared_descriptors,))
 
     if t_init == 0 and t_end == 0:  # By default, the script does the analysis on all the time points
         t_end = np.shape(data_TS)[1]
         t_total = [t for t in range(t_init, t_end)]
 
+    # Time points with all the outputs. With -k, a first pass computes only the hyper coherence (and the average edge
+    # violation) of all the time points, block after block, and the other outputs are computed only for the selected ones
+    t_selected = t_total
+    if selection != None:
+        coherence_blocks = contiguous_blocks(t_total, min(int(np.ceil(len(t_total) / ncores)), ts_simplicial.frames_per_block()))
+        coherence_results = [result for results in pool.starmap(launch_code_coherence_block,
+                                                                [(t_block[0], t_block[-1] + 1) for t_block in coherence_blocks])
+                             for result in results]
+        t_selected = select_time_points([result[0] for result in coherence_results],
+                                        [result[5] for result in coherence_results], *selection)
+        sys.stderr.write("[selection] {0} of {1} time points selected ({2} {3})\n".format(
+            len(t_selected), len(t_total), *selection))
+        # The time points that are not selected are reported with the outputs of the first pass
+        t_not_selected = set(t_total) - set(t_selected)
+        handle_output_block([result for result in coherence_results if result[0] in t_not_selected])
+
     # Main parallel computation
-    for i in t_total:
-        pool.apply_async(launch_code_one_t, (i, ), callback=handle_output)
+    if adaptive != None:
+        # Adaptive sampling: rounds of time points, from the coarse stride to the midpoints of the intervals to refine
+        stride, tolerance = adaptive
+        computed = {}
+        t_round, n_rounds = sorted(set(t_total[::stride] + t_total[-1:])), 0
+        while t_round:
+            for result in pool.map(launch_code_one_t, t_round):
+                handle_output(result)
+                computed[result[0]] = result[1:7]
+            t_round, n_rounds = refine_time_points(computed, tolerance), n_rounds + 1
+        # The time points that are skipped are reported with nan indicators
+        handle_output_block([[t, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan] + higher_order_nan() + [None]
+                             for t in t_total if t not in computed])
+        sys.stderr.write("[adaptive] computed {0} of {1} time points ({2} rounds), skipped {3}\n".format(
+            len(computed), len(t_total), n_rounds, len(t_total) - len(computed)))
+    elif max_transpositions != None:
+        # Temporal mode: each core follows the time points in order (by default, one block of contiguous time points per core)
+        if block_size == 1:
+            block_size = int(np.ceil(len(t_selected) / ncores))
+        vineyard_counters = [0, 0, 0, 0]
+        for g, group in enumerate(groups):
+            for t_block in contiguous_blocks(t_selected, block_size):
+                pool.apply_async(launch_code_group,
+                                 (g, launch_code_block_vineyard, (t_block[0], t_block[-1] + 1, max_transpositions)),
+                                 callback=partial(handle_output_block_vineyard, group=group))
+    elif block_size > 1:
+        for g, group in enumerate(groups):
+            for t_block in contiguous_blocks(t_selected, block_size):
+                pool.apply_async(launch_code_group, (g, launch_code_block, (t_block[0], t_block[-1] + 1)),
+                                 callback=partial(handle_output_block, group=group))
+    else:
+        for g, group in enumerate(groups):
+            for i in t_selected:
+                pool.apply_async(launch_code_group, (g, launch_code_one_t, (i, )),
+                                 callback=partial(handle_output, group=group))
 
     pool.close()
-    pool.join()
\ No newline at end of file
+    pool.join()
+
+    if max_transpositions != None:
+        sys.stderr.write("[vineyard] time points: {0}, vineyard updates: {1}, fallbacks to full reduction: {2}, "
+                         "transpositions: {3}\n".format(*vineyard_counters))
+
+    # Free the shared memory blocks
+    for ts_group in ts_groups:
+        ts_group.release_shared_memory()
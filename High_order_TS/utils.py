@@ -3,19 +3,52 @@ import numpy as np
 import pandas as pd
 import sys
 import scipy.io as sio  # For reading the matlab .mat format
-from scipy.stats import zscore, entropy
-from scipy.special import binom as binomial
+from scipy.stats import zscore, entropy, kendalltau
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree
 import collections
 import pickle as pk
 import itertools
+import heapq
+import math
+import time
 import persim
 import cechmate as cm
+import os
+import shutil
+import tempfile
+import hashlib
+from multiprocessing import shared_memory
+from multiprocessing.pool import ThreadPool
+try:
+    # Optional: compiled kernels of the 'numba' backend (-e), without it only the 'numpy' one is available
+    import numba
+except ImportError:
+    numba = None
 
 
 # Function that parse all the inputs from the stdin
 def parse_input(input):
     t_init = t_end = 0
     ncores = 1
+    block_size = 1
+    memory_budget = DEFAULT_MEMORY_BUDGET
+    flag_memory_report = False
+    dtype = np.float64
+    cache_dir = None
+    seed = None
+    max_transpositions = None
+    wasserstein_order = None
+    output_mode = 'complexity'
+    selection = None
+    adaptive = None
+    large_N = False
+    sparse = None
+    max_order = 3
+    groups_file = None
+    backend = 'numpy'
+    threads = 1
+    stream = None
     null_model_flag = False
     flag_edgeweight = False
     flag_edgeweight_fn = None
@@ -30,6 +63,72 @@ def parse_input(input):
             t_end = int(input[s + 2])
         if sys.argv[s] == '-p' or input[s] == '-P':
             ncores = int(input[s + 1])
+        if sys.argv[s] == '-b' or input[s] == '-B':
+            # -> number of contiguous time points processed together by each core
+            block_size = int(input[s + 1])
+        if sys.argv[s] == '-m' or input[s] == '-M':
+            # -> memory budget (in MB) for the precomputation of the edges and triplets statistics
+            memory_budget = float(input[s + 1])
+            flag_memory_report = True
+        if sys.argv[s] == '-f' or input[s] == '-F':
+            # -> floating point precision of the whole computation (float64 or float32)
+            dtype = np.dtype(input[s + 1]).type
+        if sys.argv[s] == '-c' or input[s] == '-C':
+            # -> folder of the cache with the precomputed statistics of edges and triplets
+            cache_dir = input[s + 1]
+        if sys.argv[s] == '-r' or input[s] == '-R':
+            # -> seed of the reshuffling of the null model
+            seed = int(input[s + 1])
+        if sys.argv[s] == '-v' or input[s] == '-V':
+            # -> temporal mode: persistence updated with vineyard transpositions between consecutive frames
+            max_transpositions = int(input[s + 1])
+        if sys.argv[s] == '-w' or input[s] == '-W':
+            # -> order of the exact Wasserstein distance used for the hyper complexity (instead of the sliced one)
+            wasserstein_order = float(input[s + 1])
+            if not wasserstein_order >= 1:
+                raise ValueError("The order of the Wasserstein distance (-w) must be at least 1, not {0}".format(wasserstein_order))
+        if sys.argv[s] == '-o' or input[s] == '-O':
+            # -> outputs to compute (the stages needed only by the other outputs are skipped)
+            output_mode = input[s + 1]
+            if output_mode not in OUTPUT_MODES:
+                raise ValueError("Unknown output mode '{0}' (-o): use one of {1}".format(output_mode, ', '.join(OUTPUT_MODES)))
+        if sys.argv[s] == '-k' or input[s] == '-K':
+            # -> two passes: hyper coherence of all the time points, the other outputs only for the selected ones
+            selection = (input[s + 1], float(input[s + 2]))
+            if selection[0] not in SELECTION_RULES:
+                raise ValueError("Unknown selection rule '{0}' (-k): use one of {1}".format(selection[0], ', '.join(SELECTION_RULES)))
+        if sys.argv[s] == '-a' or input[s] == '-A':
+            # -> adaptive sampling: one time point every #stride, refined where the indicators change more than #tol
+            adaptive = (int(input[s + 1]), float(input[s + 2]))
+        if sys.argv[s] == '-l' or input[s] == '-L':
+            # -> large-N mode: the triangles are streamed in blocks, without storing their tables
+            large_N = True
+        if sys.argv[s] == '-x' or input[s] == '-X':
+            # -> approximate sparse mode: only part of the triangles enter the filtration
+            sparse = (input[s + 1], float(input[s + 2]))
+            check_sparse(sparse)
+        if sys.argv[s] == '-d' or input[s] == '-D':
+            # -> maximum order of the simplices (3: triplets), the higher orders only add their violations
+            max_order = int(input[s + 1])
+            if max_order < 3:
+                raise ValueError("The maximum order (-d) must be at least 3, not {0}".format(max_order))
+        if sys.argv[s] == '-g' or input[s] == '-G':
+            # -> file with the groups of ROI (sub-networks) analysed separately, instead of the whole data
+            groups_file = input[s + 1]
+        if sys.argv[s] == '-e' or input[s] == '-E':
+            # -> backend of the per-frame kernels (weights, violations and projection on the edges)
+            backend = input[s + 1]
+            if backend not in KERNEL_BACKENDS:
+                raise ValueError("Unknown backend '{0}' (-e): use one of {1}".format(backend, ', '.join(KERNEL_BACKENDS)))
+        if sys.argv[s] == '-i' or input[s] == '-I':
+            # -> number of threads sharing the weights and the violations of each time point
+            threads = int(input[s + 1])
+        if sys.argv[s] == '-q' or input[s] == '-Q':
+            # -> streaming mode: frames read as they arrive, running statistics over a window (0: the whole history)
+            stream = (int(input[s + 1]), int(input[s + 2]))
+            if stream[0] < 2 or (stream[1] != 0 and stream[1] < stream[0]):
+                raise ValueError("The streaming mode (-q) needs at least 2 warm-up frames, and a window (if not 0) not "
+                                 "shorter than them, not {0} and {1}".format(*stream))
         if sys.argv[s] == '-n' or input[s] == '-N':
             # ->  z-score of edges and triplets is computed from the shuffled original data
             null_model_flag = True
@@ -39,11 +138,12 @@ def parse_input(input):
             flag_edgeweight_fn = input[s + 1]
     t_total = [t for t in range(t_init, t_end)]
 
-    return(path_file, t_init, t_end, t_total, ncores, null_model_flag, flag_edgeweight, flag_edgeweight_fn)
+    return(path_file, t_init, t_end, t_total, ncores, block_size, memory_budget, flag_memory_report, dtype, cache_dir, seed, max_transpositions, wasserstein_order, output_mode, selection, adaptive, large_N, sparse, max_order, groups_file, backend, threads, stream, null_model_flag, flag_edgeweight, flag_edgeweight_fn)
 
 
 # Function that loads the multivariate time series from different formats
-def load_data(path_single_file):
+# (dtype sets the floating point precision of the returned array, e.g. np.float32 for the single-precision mode)
+def load_data(path_single_file, dtype=np.float64):
     extension_file = path_single_file.split('.')[-1]
     if extension_file == 'mat':
         data = load_data_mat(path_single_file)
@@ -52,7 +152,7 @@ def load_data(path_single_file):
     elif extension_file == 'txt':
         data = load_normaltxt(path_single_file)
     # print(np.shape(data))
-    return(data)
+    return(np.asarray(data, dtype=dtype))
 
 
 # Load data in .mat format (rows are ROI, columns are the time instants)
@@ -91,27 +191,156 @@ def load_normaltxt(path_single_file):
     return(np.transpose(data))
 
 
+# Streaming mode (option -q): seconds without new lines after which a followed file is considered complete, and
+# interval (in seconds) between two checks of its size
+STREAM_IDLE_TIMEOUT = 10
+STREAM_POLL_INTERVAL = 0.05
+
+
+# Function that reads the frames of a multivariate time series while they are written, one per line (the values of the
+# ROI as in a row of the .txt format, or after the time as in the .txt_kaneko format, whose first line and separators are
+# skipped). The frames come from the standard input ('-'), e.g. a pipe, or from a file that is followed while it grows,
+# until no new line is written for idle_timeout seconds
+def stream_frames(path_file, dtype=np.float64, idle_timeout=STREAM_IDLE_TIMEOUT):
+    kaneko = path_file.split('.')[-1] == 'txt_kaneko'
+    f = sys.stdin if path_file == '-' else open(path_file)
+    first_line = True
+    pending = ''
+    last_read = time.monotonic()
+    try:
+        while True:
+            line = f.readline()
+            if line == '' or (f is not sys.stdin and not line.endswith('\n')):
+                # End of the file: waiting for the next line (or for the end of the line being written)
+                pending += line
+                if f is sys.stdin or time.monotonic() - last_read > idle_timeout:
+                    break
+                time.sleep(STREAM_POLL_INTERVAL)
+                continue
+            line, pending = pending + line, ''
+            last_read = time.monotonic()
+            values = np.array(line.split(), dtype=np.float64)
+            if len(values) == 0:
+                continue
+            if kaneko:
+                # (the separators are in the shape of t 0 0 0... 0 eps)
+                if first_line or (values[0] == 0 and values[1] == 0):
+                    first_line = False
+                    continue
+                values = values[1:]
+            yield(values.astype(dtype))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+# Load the groups of ROI of the option -g: one group per line, its name followed by the indices of its ROI (rows of the
+# loaded data, starting from 0), single or as ranges 'first-last'. Empty lines and lines starting with '#' are skipped.
+# Each group must have at least min_size ROI (the maximum order of the simplices). The ROI of a group are sorted
+def load_roi_groups(path_groups_file, num_ROI, min_size=3):
+    groups = []
+    with open(path_groups_file) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith('#'):
+                continue
+            rois = []
+            for field in fields[1:]:
+                first, _, last = field.partition('-')
+                rois.extend(range(int(first), int(last or first) + 1))
+            if len(rois) < min_size or len(set(rois)) < len(rois) or min(rois) < 0 or max(rois) >= num_ROI:
+                raise ValueError("Group '{0}' (-g): at least {1} distinct ROI between 0 and {2} are needed".format(
+                    fields[0], min_size, num_ROI - 1))
+            if fields[0] in [name for name, _ in groups]:
+                raise ValueError("Group '{0}' (-g) is defined twice".format(fields[0]))
+            groups.append((fields[0], np.array(sorted(rois))))
+    return(groups)
+
+
+# Default memory budget (in MB) for the streaming computation of the edge and triplet statistics
+DEFAULT_MEMORY_BUDGET = 1024
+
+# Precomputed arrays that are published in shared memory for the Pool workers
+SHARED_ARRAYS = ['raw_data', 'positive_bits', 'negative_bits', 'ets_vertices', 'ets_zscore', 'ets_max',
+                 'triplets_vertices', 'triplets_ts_zscore', 'triplets_max', 'triplets_edges']
+
+# Arrays stored in the statistics cache (the version is part of the key, to be increased if their meaning changes)
+CACHED_ARRAYS = ['raw_data', 'ets_zscore', 'ets_max', 'triplets_ts_zscore', 'triplets_max']
+CACHE_VERSION = 1
+
+# Outputs computed for each time point with the option -o (the stages needed only by the other outputs are skipped):
+# 'coherence' the hyper coherence and the average edge violation, 'dv' also the projection of the violations on the
+# edges (saved with -s), 'complexity' also the persistence diagram and the hyper-complexity indicators (default)
+OUTPUT_MODES = {'coherence': ('coherence',),
+                'dv': ('coherence', 'dv'),
+                'complexity': ('coherence', 'dv', 'complexity')}
+
+# Rules of the selection of the time points with the option -k (see select_time_points)
+SELECTION_RULES = ('top', 'bottom', 'above', 'below')
+
+# Rules of the approximate sparse mode with the option -x (see sparsify_filtration)
+SPARSE_RULES = ('quantile', 'topk')
+
+# Backends of the per-frame kernels with the option -e: 'numpy' (array operations, reference) or 'numba' (compiled
+# loops, see the kernels at the end of this file), available only if numba is installed
+KERNEL_BACKENDS = ('numpy', 'numba')
+
+# Working memory of the first pass of the selection with the option -k (see compute_coherence_block): bytes for each
+# simplex and time point, between products, weights, coherence masks and the weights of the edges of each triangle
+SELECTION_BYTES_PER_CELL = 64
+
+# Thread pools of the option -i, one for each number of threads, created by each process at their first use.
+# The threads of a pool do not survive a fork, so a forked process (e.g. a Pool worker) starts without pools
+THREAD_POOLS = {}
+os.register_at_fork(after_in_child=THREAD_POOLS.clear)
+
+# Prior costs of the temporal mode with the option -v (see persistence_vineyard), replaced by the times measured on the
+# frames: seconds of a transposition, and ratio between the reduction building R and V and the one of the default mode
+VINEYARD_TRANSPOSITION_COST = 2.5e-6
+VINEYARD_DECOMPOSITION_RATIO = 20
+
+# Number of directions of the sliced Wasserstein distance (hyper-complexity indicators), as in persim
+SLICED_WASSERSTEIN_M = 50
+
+
 class simplicial_complex_mvts():
-    def __init__(self, multivariate_time_series, null_model_flag):
+    def __init__(self, multivariate_time_series, null_model_flag, memory_budget=DEFAULT_MEMORY_BUDGET, dtype=np.float64,
+                 cache_dir=None, seed=None, large_N=False, max_order=3, rois=None):
 
         # Rows and columns = ROI and time points
         nR, T = np.shape(multivariate_time_series)
 
-        # Variables
-        self.raw_data = multivariate_time_series
+        # Variables (dtype is the floating point precision used by the whole engine)
+        self.raw_data = np.asarray(multivariate_time_series, dtype=dtype)
         self.num_ROI = nR                           # Nodes = regions of interest
         self.T = T                                  # Time points
 
+        # ROI of the group analysed (option -g), as rows of multivariate_time_series (None: all of them). The data are
+        # restricted to them after the reshuffling of the null model and the z-score, so that all the groups see the same
+        # signals of the whole data
+        self.rois = rois
+        if rois is not None:
+            self.num_ROI = len(rois)
+
         # Edges
-        self.ets_indexes = {}
+        self.ets_vertices = None
         self.ets_zscore = []
         self.ets_max = None
 
         # Triplets
-        self.triplets_indexes = {}
+        self.triplets_vertices = None
         self.triplets_ts_zscore = []
         self.triplets_max = None
 
+        # Memory budget (in MB) for the working arrays of the precomputation, and its peak footprint (in bytes)
+        self.memory_budget = memory_budget
+        self.precompute_peak_bytes = 0
+        self.precompute_working_bytes = 0
+
+        # Bit-packed signs of the z-scored data (ROI x T/8), one plane for the positive and one for the negative values
+        self.positive_bits = None
+        self.negative_bits = None
+
         # Variables for the filtration
         self.list_simplices = []
         self.list_violations = []
@@ -119,20 +348,66 @@ class simplicial_complex_mvts():
         self.percentage_CC_triangles_positive = 0
         self.percentage_CC_triangles_negative = 0
 
-        # If null model is on, do an independent reshuffling of the original time series
-        if null_model_flag == True:
-            self.shuffle_original_data()
+        # Order of the exact Wasserstein distance of the hyper-complexity indicators (None: sliced Wasserstein distance)
+        self.wasserstein_order = None
+        # Outputs computed for each time point (see OUTPUT_MODES)
+        self.outputs = OUTPUT_MODES['complexity']
+
+        # Large-N mode: the tables of the triplets are not stored, and each time point streams the triangles in blocks
+        self.large_N = large_N
+        # Approximate sparse mode: rule and value choosing the triangles of the filtration (None: all the valid ones)
+        self.sparse = None
+        # Backend of the per-frame kernels (see KERNEL_BACKENDS)
+        self.backend = 'numpy'
+        # Threads sharing the weights and the violations of each time point (option -i)
+        self.threads = 1
+
+        # Maximum order of the simplices: from 4 on, their statistics are stored in the arrays of higher_order_arrays
+        self.max_order = max_order
+
+        # If a cache folder is given, the statistics are stored in (or loaded from) a bundle identified by the input data.
+        # The null model can be cached only when its reshuffling is reproducible, i.e. with a seed
+        self.cache_path = None
+        if cache_dir is not None and (null_model_flag == False or seed is not None):
+            self.cache_path = os.path.join(cache_dir, self.cache_key(null_model_flag, seed))
+        # Bundle of the same input restricted to its first subset_num_ROI ROI, whose statistics are reused (see
+        # find_subset_cache), and number of simplices whose statistics are copied from it
+        self.subset_cache_path = None
+        self.subset_num_ROI = 0
+        self.reused_simplices = 0
+
+        if self.cache_path is not None and os.path.isdir(self.cache_path):
+            # Memory-mapping the z-scored data and the statistics of edges and triplets computed by a previous run
+            self.load_statistics(self.cache_path)
+            self.compute_sign_bits()
+            self.compute_simplices_indexes()
+        else:
+            if self.cache_path is not None and rois is None:
+                self.subset_cache_path = self.find_subset_cache(cache_dir, null_model_flag, seed)
+
+            # If null model is on, do an independent reshuffling of the original time series
+            if null_model_flag == True:
+                self.shuffle_original_data(seed)
 
-        # Computing the z-score of the initial data and replace the variable self.raw_data
-        self.compute_zscore_data()
+            # Computing the z-score of the initial data and replace the variable self.raw_data
+            self.compute_zscore_data()
+            if rois is not None:
+                self.raw_data = self.raw_data[rois]
 
-        # Initialising the variables by computing the edges and triplets
-        self.compute_edges_triplets()
+            # Precomputing the sign pattern of the data, used to evaluate the coherence of edges and triplets
+            self.compute_sign_bits()
 
-    def shuffle_original_data(self):
-        # Shuffling the original time series
-        data = np.array([list(np.random.permutation(row))
-                         for row in self.raw_data])
+            # Initialising the variables by computing the edges and triplets
+            self.compute_edges_triplets()
+
+            if self.cache_path is not None:
+                self.save_statistics(self.cache_path)
+
+    def shuffle_original_data(self, seed=None):
+        # Shuffling the original time series (reproducible if a seed is given)
+        random_state = np.random if seed is None else np.random.RandomState(seed)
+        data = np.array([list(random_state.permutation(row))
+                         for row in self.raw_data], dtype=self.raw_data.dtype)
         # Save it
         self.raw_data = data
 
@@ -140,81 +415,262 @@ class simplicial_complex_mvts():
         # Computing the z-score of the data
         self.raw_data = zscore(self.raw_data, axis=1)
 
+    def compute_sign_bits(self):
+        # Packing along the time axis the sign of each signal (8 time points per byte).
+        # Zeros belong to neither plane, so they are never coherent (as in coherence_function)
+        self.positive_bits = np.packbits(self.raw_data > 0, axis=1)
+        self.negative_bits = np.packbits(self.raw_data < 0, axis=1)
+
+    # Function that returns the bit-packed coherence of a set of simplices (rows of vertices) for the bytes containing [t_init, t_end)
+    # A bit is 1 when all the signals of the simplex are positive or all are negative
+    def coherence_bits(self, vertices, t_init, t_end):
+        b_init, b_end = t_init // 8, (t_end + 7) // 8
+        positive = self.positive_bits[vertices[:, 0], b_init:b_end]
+        negative = self.negative_bits[vertices[:, 0], b_init:b_end]
+        for k in range(1, np.shape(vertices)[1]):
+            positive = positive & self.positive_bits[vertices[:, k], b_init:b_end]
+            negative = negative & self.negative_bits[vertices[:, k], b_init:b_end]
+        return(positive | negative)
+
+    # Function that returns a boolean matrix (number of simplices x number of time points) with the coherence
+    # of each simplex in the time interval [t_init, t_end). The coherence rule flips the sign of the weight of each
+    # simplex at each time point (correction_for_coherence), so it needs the bits themselves, not the number of coherent
+    # time points: the sign planes are combined 8 time points per byte, and the bits are unpacked at once for the block
+    def compute_coherence(self, vertices, t_init, t_end):
+        bits = np.unpackbits(self.coherence_bits(vertices, t_init, t_end), axis=1)
+        offset = t_init - 8 * (t_init // 8)
+        return(bits[:, offset:offset + t_end - t_init].astype(bool))
+
     # Initial setup: computation of the edges and triplets
     def compute_edges_triplets(self):
-        #-------------------------EDGES-----------------------------
+        # Indexes of all the edges and triplets
+        self.compute_simplices_indexes()
 
-        # Number of possible edges as combination of nodes
-        N_edges = int(binomial(self.num_ROI, 2))
-        # Indices for the products i,j with i<j for the edges: all pairwise combinations without repetition
-        u, v = np.triu_indices(self.num_ROI, k=1, m=self.num_ROI)
+        #-------------------------EDGES-----------------------------
 
         # Initialize storage arrays
-        self.ets_zscore = np.zeros((N_edges, 2))
-        self.ets_max = np.zeros((self.T))
-
-        # Initializing the batch division
-        l_index_prev = 0
-        l_index_next = self.num_ROI - 1
-        gap = l_index_next - l_index_prev
+        self.ets_zscore = np.zeros((len(self.ets_vertices), 2), dtype=self.raw_data.dtype)
+        self.ets_max = np.zeros((self.T), dtype=self.raw_data.dtype)
 
         # To save memory, ets_zscore will save the mean and std of each independent time series
         # instead of all the z-scored edges
         # ets_max -> is a vector 1xT containing the maximum between all the z-scored edges
-        # To decrease the RAM usage, the product is done in batches of size < N
-        for i in range(self.num_ROI):
-            # Compute the element-wise product of signals
-            c_prod = self.raw_data[u[l_index_prev:l_index_next]
-                                   ] * self.raw_data[v[l_index_prev:l_index_next]]
-
-            self.ets_zscore[l_index_prev:l_index_next] = np.array(
-                [np.mean(c_prod, axis=1), np.std(c_prod, axis=1)]).T
-
-            self.ets_max = np.max(
-                np.vstack((self.ets_max, np.abs((c_prod - np.tile(self.ets_zscore[l_index_prev:l_index_next, 0], (self.T, 1)).T) /
-                                                np.tile(self.ets_zscore[l_index_prev:l_index_next, 1], (self.T, 1)).T))), axis=0)
-            l_index_prev = l_index_next
-            l_index_next += (self.num_ROI - i - 2)
-
-        # Save in a dictionary the indexes of the edges (i,j), i.e. key: index (from 0 to N*(N-1)/2), value: (i,j)
-        self.ets_indexes = dict(zip(np.arange(N_edges), zip(u, v)))
+        self.compute_products_statistics(2, self.ets_zscore, self.ets_max, self.subset_statistics('ets_zscore', 'ets_max'))
 
         #------------------------TRIPLETS----------------------------
 
-        # Number of triplets
-        N_triplets = int(binomial(self.num_ROI, 3))
-        # Indices for the products
-        self.idx_list_triplets = list(
-            itertools.combinations(range(self.num_ROI), r=3))
-        indices = np.array(self.idx_list_triplets)
-        u, v, w = indices[:, 0], indices[:, 1], indices[:, 2]
-        # Filling the rows of tts with the product
-        self.triplets_ts_zscore = np.zeros((N_triplets, 2))
-        self.triplets_max = np.zeros((self.T))
-        l_index_prev = 0
-        l_index_next = int((self.num_ROI - 1) * (self.num_ROI - 2) / 2)
-
         # Same as above,
         # To save memory, triplets_ts_zscore will save the mean and std of each independent triplet time series
         # instead of all the z-scored triplets
         # triplets_max -> is a vector 1xT containing the maximum between all the z-scored observed at each time point across all triplets
-        # To decrease the RAM usage, the product is done in batches of size < N*(N-1)
-        for i in range(self.num_ROI):
-            # print(i,l_index_prev,l_index_next)
-            c_prod = self.raw_data[u[l_index_prev:l_index_next]] * \
-                self.raw_data[v[l_index_prev:l_index_next]] * \
-                self.raw_data[w[l_index_prev:l_index_next]]
-            self.triplets_ts_zscore[l_index_prev:l_index_next] = np.array(
-                [np.mean(c_prod, axis=1), np.std(c_prod, axis=1)]).T
-            self.triplets_max = np.max(
-                np.vstack((self.triplets_max, np.abs((c_prod - np.tile(self.triplets_ts_zscore[l_index_prev:l_index_next, 0], (self.T, 1)).T) /
-                                                     np.tile(self.triplets_ts_zscore[l_index_prev:l_index_next, 1], (self.T, 1)).T))), axis=0)
-            l_index_prev = l_index_next
-            l_index_next += int((self.num_ROI - i - 2) *
-                                (self.num_ROI - i - 3) / 2)
-            gap = l_index_next - l_index_prev
-        # Saving the indices of all the triplets
-        self.triplets_indexes = dict(zip(np.arange(N_triplets), indices))
+        self.triplets_ts_zscore = np.zeros((n_choose_k(self.num_ROI, 3), 2), dtype=self.raw_data.dtype)
+        self.triplets_max = np.zeros((self.T), dtype=self.raw_data.dtype)
+        self.compute_products_statistics(3, self.triplets_ts_zscore, self.triplets_max,
+                                         self.subset_statistics('triplets_ts_zscore', 'triplets_max'))
+
+        #----------------------HIGHER ORDERS-------------------------
+
+        # Same as above for the orders from 4 (quadruplets) to max_order, whose vertices are always unranked when needed
+        for k in range(4, self.max_order + 1):
+            setattr(self, 'order{0}_zscore'.format(k), np.zeros((n_choose_k(self.num_ROI, k), 2), dtype=self.raw_data.dtype))
+            setattr(self, 'order{0}_max'.format(k), np.zeros((self.T), dtype=self.raw_data.dtype))
+            self.compute_products_statistics(k, self.simplices_statistics(k), getattr(self, 'order{0}_max'.format(k)),
+                                             self.subset_statistics('order{0}_zscore'.format(k), 'order{0}_max'.format(k)))
+
+        # Memory held by the precomputed arrays, plus the largest working set used while streaming the products
+        self.precompute_peak_bytes = self.precompute_working_bytes + sum(
+            array.nbytes for array in [self.raw_data, self.ets_vertices, self.ets_zscore, self.ets_max, self.triplets_vertices,
+                                       self.triplets_ts_zscore, self.triplets_max, self.triplets_edges] +
+            [getattr(self, name) for name in self.higher_order_arrays()] if array is not None)
+
+    # Function that builds the tables with the vertices of all the edges and triplets (sorted lexicographically,
+    # so the row of a simplex is its rank in the combinatorial number system, see simplex_rank and simplex_unrank)
+    def compute_simplices_indexes(self):
+        # Vertices and edges ID are stored with the smallest int type that fits them (int16, or int32 for large networks)
+        vertex_dtype = compact_int_dtype(self.num_ROI - 1)
+
+        # Indices for the products i,j with i<j for the edges: all pairwise combinations without repetition (N_edges x 2)
+        N_edges = n_choose_k(self.num_ROI, 2)
+        self.ets_vertices = simplex_unrank(np.arange(N_edges), self.num_ROI, 2).astype(vertex_dtype)
+
+        # Indices for the products i,j,k with i<j<k for the triplets (N_triplets x 3).
+        # In large-N mode they are unranked when needed (see simplices_vertices)
+        if self.large_N:
+            self.triplets_vertices = self.triplets_edges = None
+            return
+        N_triplets = n_choose_k(self.num_ROI, 3)
+        self.triplets_vertices = simplex_unrank(np.arange(N_triplets), self.num_ROI, 3).astype(vertex_dtype)
+
+        # Incidence table triangle -> three edges ID (ij, ik, jk)
+        self.triplets_edges = edge_index(self.triplets_vertices[:, [0, 0, 1]], self.triplets_vertices[:, [1, 2, 2]],
+                                         self.num_ROI).astype(compact_int_dtype(N_edges - 1))
+
+    # Function that returns the vertices of the simplices of order k (2: edges, 3: triplets, ...) with ranks in [start, end):
+    # rows of the tables, or unranked on the fly for the orders without table (the triplets in large-N mode, and from 4 on)
+    def simplices_vertices(self, k, start, end):
+        table = {2: self.ets_vertices, 3: self.triplets_vertices}.get(k)
+        if table is not None:
+            return(table[start:end])
+        ranks = np.arange(start, min(end, n_choose_k(self.num_ROI, k)))
+        return(simplex_unrank(ranks, self.num_ROI, k).astype(compact_int_dtype(self.num_ROI - 1)))
+
+
+    # Function that returns the statistics (mean and std of the products, one row for each rank) of the simplices of order k
+    def simplices_statistics(self, k):
+        if k == 2:
+            return(self.ets_zscore)
+        if k == 3:
+            return(self.triplets_ts_zscore)
+        return(getattr(self, 'order{0}_zscore'.format(k)))
+
+    # Names of the arrays with the statistics of the orders from 4 to max_order (shared and cached as the ones of the triplets)
+    def higher_order_arrays(self):
+        return(['order{0}_{1}'.format(k, name) for k in range(4, self.max_order + 1) for name in ['zscore', 'max']])
+
+
+    # Function that returns the key of the statistics cache: a hash of the input data (values, shape and precision),
+    # of the null model flag and of its seed. With n_ROI, the key of the input restricted to its first n_ROI ROI
+    def cache_key(self, null_model_flag, seed, n_ROI=None):
+        data = self.raw_data[:n_ROI]
+        key = hashlib.sha1()
+        key.update(np.ascontiguousarray(data).view(np.uint8))
+        key.update(str((CACHE_VERSION, data.shape, data.dtype.str, bool(null_model_flag), seed)).encode())
+        if self.max_order > 3:
+            # (the bundles with the higher orders are stored apart, the key of the others does not change)
+            key.update(str(self.max_order).encode())
+        if self.rois is not None:
+            # (bundle of a group of ROI of the input)
+            key.update(str(list(self.rois)).encode())
+        return(key.hexdigest())
+
+    # Function that saves the statistics in the folder cache_path (one .npy file for each array).
+    # The folder is first written with a temporary name and then renamed, so that concurrent runs never read a partial bundle
+    def save_statistics(self, cache_path):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=os.path.dirname(cache_path), prefix='.tmp_')
+        for name in CACHED_ARRAYS + self.higher_order_arrays():
+            np.save(os.path.join(tmp_path, name + '.npy'), getattr(self, name))
+        try:
+            os.rename(tmp_path, cache_path)
+        except OSError:
+            # Another run has already stored the same statistics
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    # Function that looks in cache_dir for the bundle of the largest subset of the ROI of this input, i.e. of the same
+    # input restricted to its first n_ROI < num_ROI ROI (same null model and seed, whose reshuffling of the first ROI
+    # does not depend on the others). It returns its folder (None if there is none) and sets subset_num_ROI.
+    # It must be called on the input data, before the reshuffling and the z-score
+    def find_subset_cache(self, cache_dir, null_model_flag, seed):
+        candidates = set()
+        for name in (os.listdir(cache_dir) if os.path.isdir(cache_dir) else []):
+            path = os.path.join(cache_dir, name, 'raw_data.npy')
+            if not name.startswith('.') and os.path.isfile(path):
+                shape = np.load(path, mmap_mode='r').shape
+                if shape[0] < self.num_ROI and shape[1:] == self.raw_data.shape[1:]:
+                    candidates.add(shape[0])
+        for n_ROI in sorted(candidates, reverse=True):
+            path = os.path.join(cache_dir, self.cache_key(null_model_flag, seed, n_ROI))
+            if os.path.isdir(path):
+                self.subset_num_ROI = n_ROI
+                return(path)
+        return(None)
+
+    # Function that returns the statistics and the maximum per time point of the given names (see CACHED_ARRAYS) stored
+    # in the bundle of the subset of the ROI (memory-mapped), None if there is no such bundle
+    def subset_statistics(self, statistics_name, max_name):
+        if self.subset_cache_path is None:
+            return(None)
+        return(tuple(np.load(os.path.join(self.subset_cache_path, name + '.npy'), mmap_mode='r')
+                     for name in [statistics_name, max_name]))
+
+
+    # Function that loads (memory-mapped, read-only) the statistics stored in the folder cache_path
+    def load_statistics(self, cache_path):
+        for name in CACHED_ARRAYS + self.higher_order_arrays():
+            setattr(self, name, np.load(os.path.join(cache_path, name + '.npy'), mmap_mode='r'))
+
+    # Function that computes the mean and std of the product time series of each simplex of the given order (one row of
+    # statistics for each rank), and updates in place max_abs with the maximum absolute z-score observed at each time point.
+    # To bound the RAM usage, the products are streamed in chunks of simplices whose size is set by the memory budget.
+    # If subset is given (statistics and maximum of the first subset_num_ROI ROI, see subset_statistics), the statistics
+    # of the simplices among these ROI are copied from it, and only the ones involving the other ROI are computed
+    def compute_products_statistics(self, order, statistics, max_abs, subset=None):
+        chunk = self.chunk_size()
+        if subset is not None:
+            np.maximum(max_abs, subset[1], out=max_abs)
+        for start in range(0, len(statistics), chunk):
+            idx = self.simplices_vertices(order, start, start + chunk)
+            rows = np.arange(start, start + len(idx))
+            if subset is not None:
+                reused = np.all(idx < self.subset_num_ROI, axis=1)
+                statistics[rows[reused]] = subset[0][simplex_rank(idx[reused], self.subset_num_ROI)]
+                self.reused_simplices += int(np.count_nonzero(reused))
+                idx, rows = idx[~reused], rows[~reused]
+                if len(idx) == 0:
+                    continue
+            # Compute the element-wise product of signals
+            c_prod = self.raw_data[idx[:, 0]]
+            for k in range(1, np.shape(idx)[1]):
+                c_prod *= self.raw_data[idx[:, k]]
+            c_mean = np.mean(c_prod, axis=1)
+            c_std = np.std(c_prod, axis=1)
+            statistics[rows, 0] = c_mean
+            statistics[rows, 1] = c_std
+            # Absolute z-score of the chunk, computed in place
+            c_prod -= c_mean[:, None]
+            c_prod /= c_std[:, None]
+            np.abs(c_prod, out=c_prod)
+            np.maximum(max_abs, np.max(c_prod, axis=0), out=max_abs)
+            # The product, one gathered factor and the temporary array of np.std are alive at the same time
+            self.precompute_working_bytes = max(self.precompute_working_bytes, 3 * c_prod.nbytes)
+
+    # Number of simplices whose products are computed at once, so that the working arrays stay within the memory budget (in MB)
+    def chunk_size(self):
+        bytes_per_simplex = 3 * self.T * self.raw_data.itemsize
+        return(max(1, int(self.memory_budget * 1024**2) // bytes_per_simplex))
+
+    # Function that reports on the stderr the memory footprint of the precomputation
+    def report_precompute_memory(self):
+        if self.precompute_peak_bytes == 0:
+            sys.stderr.write("[precompute] statistics memory-mapped from {0}\n".format(self.cache_path))
+            return
+        sys.stderr.write("[precompute] budget: {0} MB, chunk: {1} simplices, peak: {2:.1f} MB\n".format(
+            self.memory_budget, self.chunk_size(), self.precompute_peak_bytes / 1024**2))
+
+    # Function that reports on the stderr the statistics reused from the bundle of a subset of the ROI
+    def report_subset_cache(self):
+        sys.stderr.write("[precompute] statistics of the first {0} ROI reused from {1} ({2} simplices)\n".format(
+            self.subset_num_ROI, self.subset_cache_path, self.reused_simplices))
+
+    # Function that publishes the precomputed arrays in shared memory blocks (multiprocessing.shared_memory),
+    # so that the Pool workers can attach them without copies (see attach_shared_simplicial_complex).
+    # The arrays of this object are replaced with views on the shared blocks.
+    # It returns a descriptor (picklable, light) with the names of the blocks and all the other variables
+    def share_memory(self):
+        self.shared_memory_handles = []
+        shared_arrays = {}
+        for name in SHARED_ARRAYS + self.higher_order_arrays():
+            array = getattr(self, name)
+            if array is None:
+                # Tables not stored in large-N mode
+                continue
+            shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            shared_view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+            shared_view[...] = array
+            setattr(self, name, shared_view)
+            self.shared_memory_handles.append(shm)
+            shared_arrays[name] = (shm.name, array.shape, array.dtype.str)
+        attributes = {k: v for k, v in vars(self).items() if k not in shared_arrays and k != 'shared_memory_handles'}
+        return({'arrays': shared_arrays, 'attributes': attributes})
+
+    # Function that frees the shared memory blocks (to be called by the process that created them, once the workers are done)
+    def release_shared_memory(self):
+        for name in SHARED_ARRAYS + self.higher_order_arrays():
+            setattr(self, name, None)
+        for shm in self.shared_memory_handles:
+            shm.close()
+            shm.unlink()
+        self.shared_memory_handles = []
 
     # Function that, for a specific time t, computes the maximum between edges and triplets
     # This is used to replace the infinity term after computing the persistence diagram
@@ -226,133 +682,932 @@ class simplicial_complex_mvts():
 
 
     # Function that remaps the weight of a k-order products using the pure coherence rule.
-    def correction_for_coherence(self, current_list_sign, current_weight):
+    # coherence is a boolean mask (one entry per simplex), so that the sign flipping is a single masked operation
+    def correction_for_coherence(self, coherence, current_weight):
         # If the original signals are fully coherent, then the corresponding weight becomes positive, otherwise negative
-        flag = 0
-        coherence = coherence_function(current_list_sign)
-        # If all the signs are concordant then set the weight sign as positive, otherwise negative
-        if coherence == 1:
-            weight_corrected = np.abs(current_weight)
-        else:
-            weight_corrected = -np.abs(current_weight)
+        weight_corrected = np.abs(current_weight)
+        np.negative(weight_corrected, out=weight_corrected, where=~coherence)
         return(weight_corrected)
 
 
+    # Function that computes the weights of a set of simplices (rows of vertices, with the mean and std of their products
+    # in statistics) for the block of time points [t_init, t_end): z-score of the instantaneous products, then corrected
+    # with the coherence rule (one row for each simplex, one column for each time point)
+    def compute_products_weights(self, vertices, statistics, t_init, t_end):
+        if self.threads > 1:
+            # The simplices are split among the threads
+            weights = np.empty((len(vertices), t_end - t_init), dtype=self.raw_data.dtype)
+            def compute_rows(start, end):
+                weights[start:end] = self.compute_products_weights_rows(vertices[start:end], statistics[start:end], t_init, t_end)
+            self.map_threads(compute_rows, len(vertices))
+            return(weights)
+        return(self.compute_products_weights_rows(vertices, statistics, t_init, t_end))
+
+
+    # Same as above, in the calling thread
+    def compute_products_weights_rows(self, vertices, statistics, t_init, t_end):
+        # Values of all the signals in the block
+        x = self.raw_data[:, t_init:t_end]
+        if self.backend == 'numba':
+            # Products, z-score and coherence rule in one compiled loop (the coherence from the signs of the values)
+            weights = np.empty((len(vertices), t_end - t_init), dtype=x.dtype)
+            products_weights_kernel(x, vertices, statistics, weights)
+            return(weights)
+        products = x[vertices[:, 0]] * x[vertices[:, 1]]
+        for k in range(2, np.shape(vertices)[1]):
+            products = products * x[vertices[:, k]]
+        weights = (products - statistics[:, 0:1]) / statistics[:, 1:2]
+        coherence = self.compute_coherence(vertices, t_init, t_end)
+        return(self.correction_for_coherence(coherence, weights))
+
+
+    # Function that computes, for the block of time points [t_init, t_end), the weights of all the edges and triplets
+    # using array operations: z-score of the instantaneous products, then corrected with the coherence rule.
+    # It returns the weights assigned to the nodes (one per time point), and two matrices (simplices x time points)
+    # aligned with ets_vertices and triplets_vertices
+    def compute_simplices_weights_block(self, t_init, t_end):
+        # Finds the maximum weight among all edges and triplets for each time step.
+        # It will be assigned to all the nodes (i.e. nodes enter at the same instant)
+        m_weights = np.maximum(np.ceil(self.triplets_max[t_init:t_end]), np.ceil(self.ets_max[t_init:t_end]))
+
+        # Edges: z-score of the product x_i * x_j, and triplets: z-score of the product x_i * x_j * x_k
+        edges_weights = self.compute_products_weights(self.ets_vertices, self.ets_zscore, t_init, t_end)
+        triplets_weights = self.compute_products_weights(self.triplets_vertices, self.triplets_ts_zscore, t_init, t_end)
+        return(m_weights, edges_weights, triplets_weights)
+
+
+    # Same as above, for a single time t (the weights are returned as vectors)
+    def compute_simplices_weights(self, t_current):
+        m_weights, edges_weights, triplets_weights = self.compute_simplices_weights_block(t_current, t_current + 1)
+        return(m_weights[0], edges_weights[:, 0], triplets_weights[:, 0])
+
+
+    # Function that computes only the hyper coherence and the average edge violation of the block [t_init, t_end)
+    # (first pass of the selection of the time points). As in large-N mode, no sorting is needed: a triangle enters
+    # after one of its edges when its weight is not larger, or nan, so the violations are found streaming the triangles
+    # in blocks within half of the memory budget (the other half is left to the edges, see frames_per_block), and only
+    # the weights of the edges are kept for the whole block of time points
+    def compute_coherence_block(self, t_init, t_end):
+        if self.large_N:
+            frames = [self.stream_triangles(t, OUTPUT_MODES['coherence']) for t in range(t_init, t_end)]
+            return(np.array([frame[2] for frame in frames]), np.array([frame[1][0] for frame in frames]))
+        n_times = t_end - t_init
+        edges_weights = self.compute_products_weights(self.ets_vertices, self.ets_zscore, t_init, t_end)
+        n_violating, n_valid_positive, n_missing_edges = (np.zeros(n_times, dtype=np.int64) for i in range(3))
+        block = max(1, int(self.memory_budget * 1024**2) // (2 * SELECTION_BYTES_PER_CELL * n_times))
+        for start in range(0, len(self.triplets_vertices), block):
+            end = min(start + block, len(self.triplets_vertices))
+            weights = self.compute_products_weights(self.triplets_vertices[start:end], self.triplets_ts_zscore[start:end],
+                                                    t_init, t_end)
+            # Edges entered before each triangle: valid triangles, and violating ones (positive with a missing edge)
+            edges_present = np.sum((weights[:, None, :] <= edges_weights[self.triplets_edges[start:end]]) |
+                                   np.isnan(weights)[:, None, :], axis=1)
+            valid_triangles = edges_present == 3
+            positive_triangles = weights >= 0
+            violating_triangles = ~valid_triangles & positive_triangles
+            n_violating += np.count_nonzero(violating_triangles, axis=0)
+            n_valid_positive += np.count_nonzero(valid_triangles & positive_triangles, axis=0)
+            n_missing_edges += np.sum(np.where(violating_triangles, 3 - edges_present, 0), axis=0)
+        # Fraction of positive triangles discarded (hyper coherence) and average number of missing edges
+        hyper_coherence = (1.0 * n_violating) / (n_valid_positive + n_violating)
+        avg_edge_violation = n_missing_edges / n_violating
+        return(hyper_coherence, avg_edge_violation)
+
+
+    # Number of time points of a block of the first pass of the selection (compute_coherence_block): the weights of the
+    # edges of the whole block, with their working arrays, take at most half of the memory budget
+    def frames_per_block(self):
+        bytes_per_frame = SELECTION_BYTES_PER_CELL * len(self.ets_vertices)
+        return(max(1, int(self.memory_budget * 1024**2) // (2 * bytes_per_frame)))
+
+
+    # Function that computes the weights at the time t of all the simplices of order k (in order of rank), streaming
+    # their vertices in blocks as in large-N mode
+    def order_weights(self, k, t):
+        N_simplices = n_choose_k(self.num_ROI, k)
+        weights = np.empty(N_simplices, dtype=self.raw_data.dtype)
+        statistics = self.simplices_statistics(k)
+        block = self.triangles_per_block()
+        for start in range(0, N_simplices, block):
+            end = min(start + block, N_simplices)
+            weights[start:end] = self.compute_products_weights(self.simplices_vertices(k, start, end), statistics[start:end],
+                                                               t, t + 1)[:, 0]
+        return(weights)
+
+
+    # Function that computes, for the time t, the hyper coherence and the average violation of the orders from 4 to
+    # max_order, extending the rule of the triangles (find_violations_block) to all the orders: the simplices are sorted
+    # by descending weight (faces first, nan last), nodes and edges are always included, and a k-simplex is included
+    # when all its k faces (order k-1) are included and come before it. A face that is not included (e.g. a violating
+    # triangle) is missing for all its cofaces. A k-simplex is violating when it is positive and not included. The
+    # simplices are streamed in blocks, keeping only the weights and the inclusion of the faces. It returns the list
+    # [hyper coherence of order 4, average number of missing faces of order 4, ..., same for max_order]
+    def compute_higher_order_coherence(self, t):
+        results = []
+        faces_weights = self.order_weights(2, t)
+        faces_included = np.ones(len(faces_weights), dtype=bool)
+        block = self.triangles_per_block()
+        for k in range(3, self.max_order + 1):
+            N_simplices = n_choose_k(self.num_ROI, k)
+            statistics = self.simplices_statistics(k)
+            # (the weights and the inclusion of this order are the faces of the next one)
+            order_weights = order_included = None
+            if k < self.max_order:
+                order_weights = np.empty(N_simplices, dtype=self.raw_data.dtype)
+                order_included = np.empty(N_simplices, dtype=bool)
+            n_violating = n_valid_positive = n_missing_faces = 0
+            for start in range(0, N_simplices, block):
+                end = min(start + block, N_simplices)
+                vertices = self.simplices_vertices(k, start, end)
+                weights = self.compute_products_weights(vertices, statistics[start:end], t, t + 1)[:, 0]
+                # Faces: ranks of the simplices of order k-1 obtained removing one vertex
+                faces = np.column_stack([simplex_rank(np.delete(vertices, i, axis=1), self.num_ROI) for i in range(k)])
+                faces_before = (weights[:, None] <= faces_weights[faces]) | np.isnan(weights)[:, None]
+                faces_present = np.sum(faces_included[faces] & faces_before, axis=1)
+                included = faces_present == k
+                positive = weights >= 0
+                violating = ~included & positive
+                n_violating += int(np.count_nonzero(violating))
+                n_valid_positive += int(np.count_nonzero(included & positive))
+                n_missing_faces += int(np.sum(k - faces_present[violating]))
+                if order_weights is not None:
+                    order_weights[start:end] = weights
+                    order_included[start:end] = included
+            # (the triangles only give the inclusion of the faces of order 4, their indicators are already computed)
+            if k > 3:
+                results += [np.float64(n_violating) / (n_valid_positive + n_violating), np.float64(n_missing_faces) / n_violating]
+            faces_weights, faces_included = order_weights, order_included
+        return(results)
+
+
     # Function that creates the list of simplices (and provide also the list of violations)
     def create_simplicial_complex(self, t_current):
+        return(next(self.create_simplicial_complex_block(t_current, t_current + 1)))
 
-        # Creating the list of simplicial complex with all the edges and triangles
-        list_simplices = []
 
-        # Finds the maximum weight among all edges and triplets for this time step.
-        # It will be assigned to all the nodes (i.e. nodes enter at the same instant)
-        m_weight = np.max([np.ceil(self.triplets_max[t_current]), np.ceil(self.ets_max[t_current])])
-        # Adding all the nodes from the beginning with the same weights
-        for i in range(self.num_ROI):
-            list_simplices.append(([i], m_weight))
-
-        # Adding the edges:
-        # Also, modify the signs of the weights to correct the z-score so that: if the edge signal is fully coherent, then assign a positive sign, otherwise negative
-        for i in self.ets_indexes:
-            # Set the current edge indexes
-            indexes_ij = self.ets_indexes[i]
-            # Retrieve the mean and std for the current edge
-            c_mean = self.ets_zscore[i][0]
-            c_std = self.ets_zscore[i][1]
-            # Compute the weight of the current edge = z-score
-            weight_current = (self.raw_data[indexes_ij[0]][t_current]* self.raw_data[indexes_ij[1]][t_current]
-                              - c_mean) / c_std
-            list_of_signs = [self.raw_data[indexes_ij[0]][t_current], self.raw_data[indexes_ij[1]][t_current]]
-            # Correct the weight according to the coherence rule
-            weight_current_corrected = self.correction_for_coherence(list_of_signs, weight_current)
-            list_simplices.append((indexes_ij, weight_current_corrected))
-
-        # Adding the triplets
-        # Here I modify the signs of the weights, if it is fully coherent I assign a positive sign, otherwise negative
-        for i in self.triplets_indexes:
-            indexes_ijk = self.triplets_indexes[i]
-            c_mean = self.triplets_ts_zscore[i][0]
-            c_std = self.triplets_ts_zscore[i][1]
-            weight_current = (self.raw_data[indexes_ijk[0]][t_current] * self.raw_data[indexes_ijk[1]][t_current] *
-                              self.raw_data[indexes_ijk[2]][t_current] - c_mean) / c_std
-            list_of_signs = [self.raw_data[indexes_ijk[0]][t_current],
-                             self.raw_data[indexes_ijk[1]][t_current], self.raw_data[indexes_ijk[2]][t_current]]
-            weight_current_corrected = self.correction_for_coherence(
-                list_of_signs, weight_current)
-            list_simplices.append((indexes_ijk, weight_current_corrected))
-
-        list_simplices_for_filtration, list_violations, percentage_of_triangles_discarded = (
-            self.fix_violations(list_simplices, t_current))
-        return(list_simplices_for_filtration, list_violations, percentage_of_triangles_discarded)
-
-
-    # Function that remove all the violating triangles to create a proper filtration
-    def fix_violations(self, list_simplices, t_current):
-        # Sorting the simplices in a descending order according to weights
-        sorted_simplices = sorted(
-            list_simplices, key=lambda x: x[1], reverse=True)
-
-        # Remove the violations
-        list_violating_triangles = []
-        list_simplices_for_filtration = []
-        set_simplices = set()
-        counter = 0
-        triangles_count = 0
-        violation_triangles = 0
-        violation_triangles_negativeterms = 0
-
-        CC_triangles_positive = 0
-        total_CC_triangles = 0
-        CC_triangles_negative = 0
-
-        # Loop over the sorted simplices, and flippling the sign of all the weights (so that the points in the persistence diagram are above the diagonal)
-        for index, i in enumerate(sorted_simplices):
-            simplices, weight = i
-
-            # If the current simplex is an edge or a node, then I will immediately include it
-            if len(simplices) <= 2:
-                list_simplices_for_filtration.append((simplices, -weight))
-                # Register the simplices included in the filtration
-                set_simplices.add(tuple(simplices))
-                counter += 1
+    # Function that creates, one time point after the other, the list of simplices (and the list of violations)
+    # for the block [t_init, t_end). Weights, sign corrections and violation masks are computed for the whole block at once
+    def create_simplicial_complex_block(self, t_init, t_end):
+        if self.large_N:
+            # Large-N mode: one time point after the other, streaming the triangles
+            for t in range(t_init, t_end):
+                yield(self.stream_triangles(t))
+            return
+        # Weights of nodes, edges and triplets (already corrected with the coherence rule)
+        m_weights, edges_weights, triplets_weights = self.compute_simplices_weights_block(t_init, t_end)
+        violations_block = self.find_violations_block(m_weights, edges_weights, triplets_weights)
+        for c in range(t_end - t_init):
+            yield(self.collect_filtration(violations_block, triplets_weights, c))
+
+
+    # Function that finds the violating triangles for a block of time points (columns of the weight matrices).
+    # All the simplices are integer-coded: nodes are 0..N-1, edges N..N+N_edges-1 and then the triplets
+    def find_violations_block(self, m_weights, edges_weights, triplets_weights):
+        N_nodes = self.num_ROI
+        N_edges, n_times = np.shape(edges_weights)
+        weights = np.concatenate((np.broadcast_to(m_weights, (N_nodes, n_times)), edges_weights, triplets_weights))
+
+        # Sorting the simplices in a descending order according to weights (stable, as the sorting of the list of tuples)
+        order = self.argsort_columns(-weights)
+        # Insertion rank of each simplex in the sorted sequence
+        rank = np.empty_like(order)
+        np.put_along_axis(rank, order, np.arange(len(weights))[:, None], axis=0)
+
+        # Nodes and edges are always included. A triangle is valid (i.e. it can enter the filtration)
+        # when its rank exceeds the ranks of all its three edges
+        triplets_rank = rank[N_nodes + N_edges:]
+        edges_present = np.empty(np.shape(triplets_rank), dtype=np.intp)
+        def count_edges_present(start, end):
+            if self.backend == 'numba':
+                edges_present_kernel(rank, self.triplets_edges[start:end], N_nodes, N_nodes + N_edges + start,
+                                     edges_present[start:end])
             else:
-                # If the current simplex is a triplet, I check whether all the sub-simplices have been included.
-                flag = 0
-                for t in itertools.combinations(simplices, 2):
-                    if t in set_simplices:
-                        flag += 1
-
-                # If all the sub-simplices already belong to the set, then I add it in the filtration
-                if flag == 3:
-                    set_simplices.add(tuple(simplices))
-                    list_simplices_for_filtration.append((simplices, -weight))
-                    counter += 1
-
-                    # Count the number of positive triangles that are in the filtration
-                    if weight >= 0:
-                        triangles_count += 1
-                else:
-                    # Count the violations only for fully coherent state (--- or +++)
-                    if weight >= 0:
-                        violation_triangles += 1
-                        list_violating_triangles.append(
-                            (simplices, np.abs(weight), 3 - flag))
+                edges_present[start:end] = np.sum(rank[N_nodes + self.triplets_edges[start:end]] <
+                                                  triplets_rank[start:end, None, :], axis=1)
+        self.map_threads(count_edges_present, len(triplets_rank))
+        valid_triangles = edges_present == 3
+        positive_triangles = triplets_weights >= 0
+
+        # Fraction of positive triangle discarderd (a.k.a. the hyper coherence).
+        # The violations are counted only for fully coherent state (--- or +++)
+        violating_triangles = ~valid_triangles & positive_triangles
+        violation_count = np.count_nonzero(violating_triangles, axis=0)
+        triangles_count = np.count_nonzero(valid_triangles & positive_triangles, axis=0)
+        hyper_coherence = (1.0 * violation_count) / (triangles_count + violation_count)
+        return(weights, order, triplets_rank, edges_present, violating_triangles, hyper_coherence)
+
+
+    # Function that calls function(start, end) on consecutive chunks of [0, n), one for each thread (-i), and returns the
+    # list of their results. The chunks run in parallel where the GIL is released, i.e. in the numpy operations on
+    # arrays and in the kernels of the numba backend
+    def map_threads(self, function, n):
+        bounds = np.linspace(0, n, max(1, min(self.threads, n)) + 1).astype(np.int64)
+        if len(bounds) == 2:
+            return([function(0, n)])
+        if self.threads not in THREAD_POOLS:
+            THREAD_POOLS[self.threads] = ThreadPool(self.threads)
+        return(THREAD_POOLS[self.threads].starmap(function, zip(bounds[:-1], bounds[1:])))
+
+
+    # Function that sorts each column of values, as np.argsort(values, axis=0, kind='stable'). With the threads (-i),
+    # the columns are split among them, or, when there are fewer columns (e.g. a single time point), each column is
+    # split in chunks sorted in parallel and then merged by a last stable sort, which is fast on the sorted runs
+    # (timsort) and keeps the ties in order of index
+    def argsort_columns(self, values):
+        n, n_times = np.shape(values)
+        if self.threads == 1:
+            return(np.argsort(values, axis=0, kind='stable'))
+        order = np.empty((n, n_times), dtype=np.intp)
+        if n_times >= self.threads:
+            def sort_columns(start, end):
+                order[:, start:end] = np.argsort(values[:, start:end], axis=0, kind='stable')
+            self.map_threads(sort_columns, n_times)
+            return(order)
+        for c in range(n_times):
+            column = values[:, c]
+            runs = np.concatenate(self.map_threads(lambda start, end: start + np.argsort(column[start:end], kind='stable'), n))
+            order[:, c] = runs[np.argsort(column[runs], kind='stable')]
+        return(order)
+
+
+    # Function that collects, for the column c of a block, the sorted filtration and the list of violating triangles
+    def collect_filtration(self, violations_block, triplets_weights, c):
+        weights, order, triplets_rank, edges_present, violating_triangles, hyper_coherence = violations_block
+        weights, order, triplets_rank = weights[:, c], order[:, c], triplets_rank[:, c]
+        edges_present, triplets_weights = edges_present[:, c], triplets_weights[:, c]
+        valid_triangles = edges_present == 3
+
+        # Violating triangles sorted as they appear in the filtration: (vertices, |weight|, number of missing edges)
+        violating = np.flatnonzero(violating_triangles[:, c])
+        violating = violating[np.argsort(triplets_rank[violating], kind='stable')]
+        list_violating_triangles = (self.triplets_vertices[violating], np.abs(triplets_weights[violating]),
+                                    3 - edges_present[violating])
 
+        # Sorted simplices in the filtration (integer-coded), flipping the sign of all the weights
+        # (so that the points in the persistence diagram are above the diagonal)
+        included = np.concatenate((np.ones(self.num_ROI + len(self.ets_vertices), dtype=bool), valid_triangles))
+        sorted_included = order[included[order]]
+        filtration = (sorted_included, -weights[sorted_included])
+        return(filtration, list_violating_triangles, hyper_coherence[c])
+
+
+    # Approximate sparse mode: function that keeps in the integer-coded filtration (sorted ids, weights) only part of the
+    # triangles, following self.sparse:
+    # - ('quantile', q): the triangles with weight not lower than the q-quantile of the weights of the triangles;
+    # - ('topk', k): the triangles with all the three edges among the first k edges of the filtration.
+    # Nodes and edges are all kept. It returns the sparse filtration, the number of triangles dropped and the weight in
+    # the filtration of the first one (inf if none): up to it the filtration is exact (see hyper_complexity_lower_bound)
+    def sparsify_filtration(self, filtration):
+        simplices_ids, weights = filtration
+        N_nodes_edges = self.num_ROI + len(self.ets_vertices)
+        is_triangle = simplices_ids >= N_nodes_edges
+        rule, value = self.sparse
+        if rule == 'quantile':
+            # (the signs of the weights in the filtration are flipped)
+            kept = weights[is_triangle] <= np.nanquantile(weights[is_triangle], 1 - value)
+        else:
+            top_edges = np.zeros(len(self.ets_vertices), dtype=bool)
+            top_edges[simplices_ids[~is_triangle & (simplices_ids >= self.num_ROI)][:int(value)] - self.num_ROI] = True
+            kept = np.all(top_edges[self.triplets_edges[simplices_ids[is_triangle] - N_nodes_edges]], axis=1)
+        included = ~is_triangle
+        included[is_triangle] = kept
+        dropped = np.flatnonzero(~included)
+        cutoff = weights[dropped[0]] if len(dropped) > 0 and not np.isnan(weights[dropped[0]]) else np.inf
+        return((simplices_ids[included], weights[included]), len(dropped), cutoff)
+
+
+    # Function that converts the integer-coded filtration (sorted ids, weights) into the list of (vertices, weight) used by cechmate
+    def list_of_simplices(self, filtration):
+        simplices_ids, weights = filtration
+        N_nodes_edges = self.num_ROI + len(self.ets_vertices)
+        valid_triangles = np.zeros(len(self.triplets_vertices), dtype=bool)
+        valid_triangles[simplices_ids[simplices_ids >= N_nodes_edges] - N_nodes_edges] = True
+        list_vertices = ([[i] for i in range(self.num_ROI)] + self.ets_vertices.tolist() +
+                         self.triplets_vertices[valid_triangles].tolist())
+        # Position of each included simplex inside list_vertices
+        compact_index = np.full(N_nodes_edges + len(valid_triangles), -1)
+        compact_index[:N_nodes_edges] = np.arange(N_nodes_edges)
+        compact_index[N_nodes_edges + np.flatnonzero(valid_triangles)] = (
+            N_nodes_edges + np.arange(np.count_nonzero(valid_triangles)))
+        return([(list_vertices[i], w) for i, w in zip(compact_index[simplices_ids].tolist(), weights.tolist())])
+
+    # Function that computes the persistence diagram in dimension 1 of the integer-coded filtration (sorted ids, weights).
+    # It gives the same points, in the same order, as dgms[1] of cechmate.phat_diagrams(..., show_inf=True) on the
+    # list of simplices, without building it. The pairs are found by reducing the coboundary of the edges (same pairs as
+    # the reduction of the boundary, but much shorter reductions), read from the incidence table triplets_edges.
+    # The columns are bitsets (python int, one bit for each triangle) so each column addition is a single xor.
+    # Shortcuts: the edges killing a connected component (H0) are found with a spanning tree and skipped (clearing),
+    # and the apparent pairs (oldest cofacet of an edge whose youngest face is the same edge) are paired without any
+    # reduction. The output is a dictionary {1: diagram}, indexed as the list returned by cechmate
+    def compute_persistence_diagram(self, filtration):
+        if self.large_N:
+            return(self.compute_persistence_diagram_streaming(filtration))
+        simplices_ids, weights = filtration
+        weights = np.asarray(weights, dtype=np.float64)
+        N_nodes, N_edges = self.num_ROI, len(self.ets_vertices)
+
+        # Position in the filtration of the edges and of the triangles (in the order they enter)
+        position = np.full(N_nodes + N_edges + len(self.triplets_vertices), -1, dtype=np.int64)
+        position[simplices_ids] = np.arange(len(simplices_ids))
+        edges_position = position[N_nodes:N_nodes + N_edges]
+        triangles_position = np.flatnonzero(simplices_ids >= N_nodes + N_edges)
+        triangles = simplices_ids[triangles_position] - N_nodes - N_edges
+
+        # From here on edges and triangles are numbered by order of entrance: faces of each triangle as edge numbers
+        edges_order = np.argsort(edges_position)
+        edge_number = np.empty(N_edges, dtype=np.int64)
+        edge_number[edges_order] = np.arange(N_edges)
+        faces = edge_number[self.triplets_edges[triangles]]
+
+        # Negative edges (deaths in H0): the minimum spanning tree, taking the order of entrance as weight
+        spanning_tree = minimum_spanning_tree(coo_matrix(
+            (edge_number + 1, (self.ets_vertices[:, 0], self.ets_vertices[:, 1])), shape=(N_nodes, N_nodes)))
+        negative = np.zeros(N_edges, dtype=bool)
+        negative[spanning_tree.data.astype(np.int64) - 1] = True
+
+        # Coboundary of each edge: the triangles containing it (sorted), stored one edge after the other
+        cofacets_start = np.concatenate(([0], np.cumsum(np.bincount(faces.ravel(), minlength=N_edges))))
+        cofacets = np.repeat(np.arange(len(triangles)), 3)[np.argsort(faces.ravel(), kind='stable')]
+
+        # Apparent pairs: edge -> its oldest cofacet
+        edges_with_cofacets = np.flatnonzero(np.diff(cofacets_start) > 0)
+        oldest_cofacet = cofacets[cofacets_start[edges_with_cofacets]]
+        apparent = np.max(faces[oldest_cofacet], axis=1) == edges_with_cofacets
+        apparent_edges = dict(zip(oldest_cofacet[apparent].tolist(), edges_with_cofacets[apparent].tolist()))
+        births, deaths = edges_with_cofacets[apparent].tolist(), oldest_cofacet[apparent].tolist()
+        skipped = negative.copy()
+        skipped[edges_with_cofacets[apparent]] = True
+
+        # Reduction of the coboundary of the remaining positive edges, from the youngest to the oldest edge
+        # (the pivot is the oldest triangle, i.e. the lowest bit). The columns reduced to zero are never killed
+        cofacets, cofacets_start = cofacets.tolist(), cofacets_start.tolist()
+        reduced_columns = {}
+        essential = []
+        for edge in np.flatnonzero(~skipped)[::-1].tolist():
+            column = bitset(cofacets[cofacets_start[edge]:cofacets_start[edge + 1]])
+            while column:
+                pivot = (column & -column).bit_length() - 1
+                if pivot in apparent_edges and pivot not in reduced_columns:
+                    apparent_edge = apparent_edges[pivot]
+                    reduced_columns[pivot] = bitset(
+                        cofacets[cofacets_start[apparent_edge]:cofacets_start[apparent_edge + 1]])
+                if pivot not in reduced_columns:
+                    reduced_columns[pivot] = column
+                    births.append(edge)
+                    deaths.append(pivot)
+                    break
+                column ^= reduced_columns[pivot]
+            else:
+                essential.append(edge)
+
+        # Finite points sorted by birth (without the zero persistence pairs), then the positive edges never killed
+        edges_weights, triangles_weights = weights[edges_position[edges_order]], weights[triangles_position]
+        births, deaths = np.array(births, dtype=np.int64), np.array(deaths, dtype=np.int64)
+        sorting = np.argsort(births)
+        births, deaths = births[sorting], deaths[sorting]
+        finite = edges_weights[births] != triangles_weights[deaths]
+        essential = np.sort(np.array(essential, dtype=np.int64))
+        dgm1 = np.concatenate((np.column_stack((edges_weights[births[finite]], triangles_weights[deaths[finite]])),
+                               np.column_stack((edges_weights[essential], np.full(len(essential), np.inf)))))
+        return({1: dgm1})
+
+
+    # Large-N mode: number of triangles streamed at once, so that the working arrays of a time point stay within the
+    # memory budget (about 256 bytes for each triangle, between vertices, faces, weights, masks and sorting keys)
+    def triangles_per_block(self):
+        return(max(1, int(self.memory_budget * 1024**2) // 256))
+
+
+    # Large-N mode: function that computes the time t streaming the triangles in blocks of consecutive ranks, so that the
+    # memory used for each time point does not depend on the number of triangles. A triangle enters after one of its edges
+    # in the sorted sequence (descending weights, ties broken by ID, edges first) when its weight is not larger, or nan,
+    # so the violations are found triangle by triangle. It returns, as create_simplicial_complex:
+    # - the implicit filtration used by compute_persistence_diagram_streaming: the weights of the edges and, for each
+    #   edge, its oldest cofacet (sorting key, rank and youngest face), None if not needed;
+    # - the violations already reduced to the average edge violation and to their projection on the edges (the rows of
+    #   compute_edgeweight in the same order, None if not needed), the sums being accumulated block after block;
+    # - the hyper coherence
+    def stream_triangles(self, t, outputs=None):
+        outputs = self.outputs if outputs is None else outputs
+        N_edges, N_triplets = len(self.ets_vertices), n_choose_k(self.num_ROI, 3)
+        edges_weights = self.compute_products_weights(self.ets_vertices, self.ets_zscore, t, t + 1)[:, 0]
+        edge_number = np.empty(N_edges, dtype=np.int64)
+        edge_number[np.argsort(-edges_weights, kind='stable')] = np.arange(N_edges)
+
+        n_violating = n_valid_positive = n_missing_edges = 0
+        # For each edge: sum of the weights and number of its violating triangles, and the first of them in the list
+        # of violations (-weight, rank, position of the edge in the triangle)
+        projection = np.zeros((N_edges, 2))
+        first_violation = (np.zeros(N_edges), np.zeros(N_edges, dtype=np.int64), np.zeros(N_edges, dtype=np.int64))
+        no_violation = np.ones(N_edges, dtype=bool)
+        # For each edge: its oldest cofacet (sorting key, rank, youngest face)
+        oldest_cofacet = (np.zeros(N_edges, dtype=np.uint64), np.zeros(N_edges, dtype=np.int64),
+                          np.zeros(N_edges, dtype=np.int64))
+        no_cofacet = np.ones(N_edges, dtype=bool)
+
+        block = self.triangles_per_block()
+        for start in range(0, N_triplets, block):
+            end = min(start + block, N_triplets)
+            vertices = self.simplices_vertices(3, start, end)
+            faces = edge_index(vertices[:, [0, 0, 1]], vertices[:, [1, 2, 2]], self.num_ROI)
+            weights = self.compute_products_weights(vertices, self.triplets_ts_zscore[start:end], t, t + 1)[:, 0]
+            ranks = np.arange(start, end)
+
+            # Edges entered before each triangle: valid triangles, and violating ones (positive with a missing edge)
+            edges_present = np.sum((weights[:, None] <= edges_weights[faces]) | np.isnan(weights)[:, None], axis=1)
+            valid_triangles = edges_present == 3
+            positive_triangles = weights >= 0
+            violating = np.flatnonzero(~valid_triangles & positive_triangles)
+            n_violating += len(violating)
+            n_valid_positive += int(np.count_nonzero(valid_triangles & positive_triangles))
+            n_missing_edges += int(np.sum(3 - edges_present[violating]))
+
+            if 'dv' in outputs:
+                edges = faces[violating].ravel()
+                violation_weights = np.repeat(np.abs(weights[violating]).astype(np.float64), 3)
+                projection[:, 0] += np.bincount(edges, weights=violation_weights, minlength=N_edges)
+                projection[:, 1] += np.bincount(edges, minlength=N_edges)
+                update_first_triangles(first_violation, no_violation, edges,
+                                       (-violation_weights, np.repeat(ranks[violating], 3), np.tile([0, 1, 2], len(violating))), 3)
+
+            if 'complexity' in outputs:
+                valid = np.flatnonzero(valid_triangles)
+                valid_faces = faces[valid]
+                youngest_face = valid_faces[np.arange(len(valid)), np.argmax(edge_number[valid_faces], axis=1)]
+                update_first_triangles(oldest_cofacet, no_cofacet, valid_faces.ravel(),
+                                       tuple(np.repeat(column, 3) for column in (sortable_float_keys(-weights[valid]),
+                                             ranks[valid], youngest_face)), 2)
+
+        # Fraction of positive triangle discarded (hyper coherence) and average number of missing edges
+        hyper_coherence = np.float64(n_violating) / (n_valid_positive + n_violating)
+        avg_edge_violation = np.float64(n_missing_edges) / n_violating
+        edge_weights = None
+        if 'dv' in outputs:
+            violated = np.flatnonzero(~no_violation)
+            violated = violated[np.lexsort((first_violation[2][violated], first_violation[1][violated],
+                                            first_violation[0][violated]))]
+            edge_weights = np.column_stack((self.ets_vertices[violated], projection[violated]))
+        filtration = None
+        if 'complexity' in outputs:
+            filtration = (t, edges_weights, edge_number, no_cofacet) + oldest_cofacet
+        return(filtration, (avg_edge_violation, edge_weights), hyper_coherence)
+
+
+    # Large-N mode: function that returns the coboundaries of some edges (IDs) at the time t, i.e. their valid cofacets
+    # among the N-2 triangles containing each edge, as a list of sets of triangle keys (triangle_key)
+    def edge_cofacets(self, t, edges, edges_weights):
+        i, j = self.ets_vertices[edges, 0][:, None], self.ets_vertices[edges, 1][:, None]
+        # The N-2 other nodes of each edge (i<j)
+        k = np.arange(self.num_ROI - 2)[None, :]
+        k = k + (k >= i)
+        k = k + (k >= j)
+        vertices = np.sort(np.stack(np.broadcast_arrays(i, j, k), axis=-1), axis=-1).reshape(-1, 3)
+        ranks = simplex_rank(vertices, self.num_ROI)
+        weights = self.compute_products_weights(vertices, self.triplets_ts_zscore[ranks], t, t + 1)[:, 0]
+        faces = edge_index(vertices[:, [0, 0, 1]], vertices[:, [1, 2, 2]], self.num_ROI)
+        valid = np.all(weights[:, None] <= edges_weights[faces], axis=1) | np.isnan(weights)
+        triangles = self.triangle_key(sortable_float_keys(-weights[valid]), ranks[valid])
+        bounds = np.concatenate(([0], np.cumsum(np.count_nonzero(valid.reshape(len(edges), -1), axis=1)))).tolist()
+        return([set(triangles[start:end]) for start, end in zip(bounds[:-1], bounds[1:])])
+
+
+    # Large-N mode: function that packs the sorting keys and the ranks of some triangles in single python integers
+    # (key, then rank, in the lowest bits), compared in the order of the filtration
+    def triangle_key(self, keys, ranks):
+        shift = n_choose_k(self.num_ROI, 3).bit_length()
+        return([(key << shift) | rank for key, rank in zip(keys.tolist(), ranks.tolist())])
+
+
+    # Large-N mode: function that computes the persistence diagram in dimension 1 from the implicit filtration returned by
+    # stream_triangles, with the same reduction (and the same output) of compute_persistence_diagram: clearing of the
+    # edges of the spanning tree, apparent pairs from the oldest cofacets, then reduction of the remaining positive edges.
+    # The triangles are identified by a single integer (triangle_key), so the pivot is the smallest one, and the
+    # coboundaries are recomputed when needed (edge_cofacets): only the reduced columns are stored
+    def compute_persistence_diagram_streaming(self, filtration):
+        t, edges_weights, edge_number, no_cofacet, oldest_key, oldest_rank, oldest_youngest = filtration
+        N_nodes, N_edges = self.num_ROI, len(self.ets_vertices)
+
+        # From here on the edges are numbered by order of entrance
+        edges_order = np.argsort(edge_number)
+        has_cofacets = ~no_cofacet[edges_order]
+        oldest_triangles = self.triangle_key(oldest_key[edges_order], oldest_rank[edges_order])
+        youngest_face = edge_number[oldest_youngest[edges_order]]
+
+        # Negative edges (deaths in H0): the minimum spanning tree, taking the order of entrance as weight
+        spanning_tree = minimum_spanning_tree(coo_matrix(
+            (edge_number + 1, (self.ets_vertices[:, 0], self.ets_vertices[:, 1])), shape=(N_nodes, N_nodes)))
+        negative = np.zeros(N_edges, dtype=bool)
+        negative[spanning_tree.data.astype(np.int64) - 1] = True
+
+        # Apparent pairs: edge -> its oldest cofacet, when the edge is the youngest face of the cofacet
+        apparent = np.flatnonzero(has_cofacets & (youngest_face == np.arange(N_edges)))
+        apparent_edges = {oldest_triangles[edge]: edge for edge in apparent.tolist()}
+        births, deaths = apparent.tolist(), [oldest_triangles[edge] for edge in apparent.tolist()]
+        skipped = negative.copy()
+        skipped[apparent] = True
+
+        # Reduction of the coboundary of the remaining positive edges, from the youngest to the oldest edge
+        reduced_columns = {}
+        essential = []
+        # (their coboundaries are computed in chunks, within the memory budget)
+        positive = np.flatnonzero(~skipped)[::-1]
+        chunk = max(1, self.triangles_per_block() // N_nodes)
+        columns = []
+        for n, edge in enumerate(positive.tolist()):
+            if n % chunk == 0:
+                columns = self.edge_cofacets(t, edges_order[positive[n:n + chunk]], edges_weights)
+            column = columns[n % chunk]
+            candidates = sorted(column)
+            while column:
+                # The smallest candidate still in the column (the candidates are a heap of all the triangles added)
+                while candidates[0] not in column:
+                    heapq.heappop(candidates)
+                pivot = candidates[0]
+                if pivot in apparent_edges and pivot not in reduced_columns:
+                    reduced_columns[pivot] = self.edge_cofacets(t, edges_order[[apparent_edges[pivot]]], edges_weights)[0]
+                if pivot not in reduced_columns:
+                    reduced_columns[pivot] = column
+                    births.append(edge)
+                    deaths.append(pivot)
+                    break
+                for triangle in reduced_columns[pivot] - column:
+                    heapq.heappush(candidates, triangle)
+                column ^= reduced_columns[pivot]
+            else:
+                essential.append(edge)
+
+        # Finite points sorted by birth (without the zero persistence pairs), then the positive edges never killed
+        edges_weights = -edges_weights[edges_order].astype(np.float64)
+        # (the weights of the killing triangles are read from their keys)
+        shift = n_choose_k(N_nodes, 3).bit_length()
+        births = np.array(births, dtype=np.int64)
+        deaths = sortable_float_values(np.array([triangle >> shift for triangle in deaths], dtype=np.uint64))
+        sorting = np.argsort(births)
+        births, deaths = births[sorting], deaths[sorting]
+        finite = edges_weights[births] != deaths
+        essential = np.sort(np.array(essential, dtype=np.int64))
+        dgm1 = np.concatenate((np.column_stack((edges_weights[births[finite]], deaths[finite])),
+                               np.column_stack((edges_weights[essential], np.full(len(essential), np.inf)))))
+        return({1: dgm1})
+
+
+# Function that rebuilds a simplicial_complex_mvts from the descriptor returned by share_memory,
+# with read-only views on the shared memory blocks (nothing is recomputed nor copied)
+def attach_shared_simplicial_complex(descriptor):
+    ts_simplicial = simplicial_complex_mvts.__new__(simplicial_complex_mvts)
+    ts_simplicial.__dict__.update(descriptor['attributes'])
+    ts_simplicial.shared_memory_handles = []
+    for name, (shm_name, shape, dtype) in descriptor['arrays'].items():
+        # The block is owned (and unlinked) by the process that created it
+        shm = shared_memory.SharedMemory(name=shm_name)
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        array.flags.writeable = False
+        setattr(ts_simplicial, name, array)
+        ts_simplicial.shared_memory_handles.append(shm)
+    return(ts_simplicial)
+
+
+# Class of the streaming mode (option -q), where the frames arrive one at a time. The statistics of the signals of the
+# ROI and of the products of the simplices are running ones (Welford's algorithm), over the last window frames or over
+# the whole history (window 0). They are initialised as in simplicial_complex_mvts with the first frames of the series
+# (warm-up, ROI x frames), whose time points are computed as usual. Then each new frame (add_frame) is z-scored with
+# the running statistics of the ROI, and the products of its simplices update the running statistics of the simplices.
+# The structure then holds a single time point (0), the new frame, with the current statistics, so that all the
+# functions of simplicial_complex_mvts computing a time point apply to it. The memory does not depend on the number of
+# frames: only the frames of the window are kept, to remove them from the statistics when they leave it
+class simplicial_complex_stream(simplicial_complex_mvts):
+    def __init__(self, warmup_frames, window=0, memory_budget=DEFAULT_MEMORY_BUDGET, dtype=np.float64, large_N=False,
+                 max_order=3):
+        warmup_frames = np.asarray(warmup_frames, dtype=dtype)
+        super().__init__(warmup_frames, False, memory_budget, dtype, None, None, large_N, max_order)
+        self.window = window
+        self.n_frames = np.shape(warmup_frames)[1]
+
+        # Running mean and sum of the squared deviations of the signals of the ROI and of the products of each order
+        self.roi_statistics = welford_statistics(warmup_frames)
+        self.products_statistics = {}
+        for k in range(2, self.max_order + 1):
+            statistics = self.simplices_statistics(k).astype(np.float64)
+            self.products_statistics[k] = (statistics[:, 0], statistics[:, 1]**2 * self.n_frames)
+
+        # Frames in the window, raw and z-scored as when they were added (the products to remove are the ones added)
+        self.window_frames = None
+        if window > 0:
+            self.window_frames = collections.deque(zip(np.transpose(warmup_frames).astype(np.float64),
+                                                       np.transpose(self.raw_data).astype(np.float64)))
+
+    # Function that adds a frame (signals of the ROI) to the running statistics, removing the oldest one if the window
+    # is full, and makes it the time point 0 of the structure
+    def add_frame(self, frame):
+        frame = np.asarray(frame, dtype=np.float64)
+        leaving = None
+        if self.window_frames is not None and len(self.window_frames) == self.window:
+            leaving = self.window_frames.popleft()
+            self.n_frames -= 1
+            welford_update(*self.roi_statistics, leaving[0], self.n_frames, -1)
+        self.n_frames += 1
+        welford_update(*self.roi_statistics, frame, self.n_frames)
+        x = (frame - self.roi_statistics[0]) / welford_std(self.roi_statistics[1], self.n_frames)
+        if self.window_frames is not None:
+            self.window_frames.append((frame, x))
+
+        # The frame, z-scored and in the working precision, is the only time point of the structure
+        self.raw_data = x.astype(self.raw_data.dtype)[:, None]
+        self.T = 1
+        self.compute_sign_bits()
+
+        # Running statistics of the products of each order, updated block after block, and maximum of the absolute
+        # z-scores of the frame
+        block = self.triangles_per_block()
+        for k in range(2, self.max_order + 1):
+            mean, M2 = self.products_statistics[k]
+            statistics = self.simplices_statistics(k)
+            max_abs = np.zeros(1, dtype=self.raw_data.dtype)
+            for start in range(0, len(statistics), block):
+                end = min(start + block, len(statistics))
+                vertices = self.simplices_vertices(k, start, end)
+                if leaving is not None:
+                    welford_update(mean[start:end], M2[start:end], np.prod(leaving[1][vertices], axis=1),
+                                   self.n_frames - 1, -1)
+                product = np.prod(x[vertices], axis=1)
+                welford_update(mean[start:end], M2[start:end], product, self.n_frames)
+                statistics[start:end, 0] = mean[start:end]
+                statistics[start:end, 1] = welford_std(M2[start:end], self.n_frames)
+                zscore_abs = np.abs((product - statistics[start:end, 0]) / statistics[start:end, 1])
+                np.maximum(max_abs, np.max(zscore_abs), out=max_abs)
+            setattr(self, {2: 'ets_max', 3: 'triplets_max'}.get(k, 'order{0}_max'.format(k)), max_abs)
+
+
+# Class that keeps the reduced boundary matrix R = D V (with V upper triangular) of the filtration of a frame, so that
+# the persistence diagram of the next frame can be obtained with vineyard updates (transpositions of consecutive
+# simplices, Cohen-Steiner, Edelsbrunner and Morozov 2006) instead of a new reduction. To have the same simplices in
+# all the frames, the triangles not included in the filtration are appended at its end (in order of index): the pairs
+# of the included simplices do not change, and the edges killed by one of these triangles are the infinite points.
+# Each frame is computed in the cheapest way according to the estimated costs (costs_estimate):
+# - with transpositions from the previous frame, if R and V are kept and the update (transpositions and reading of the
+#   diagram) costs less than a reduction, and the transpositions are not more than max_transpositions;
+# - otherwise from scratch (fallback) with the reduction of the default mode (reducer, i.e. compute_persistence_diagram
+#   of simplicial_complex_mvts, with clearing and apparent pairs), which does not build R and V. They are built (reduce)
+#   only when the next frames are expected to be updated, i.e. when the transpositions of this frame, repeated for the
+#   frames a decomposition is expected to last (the remaining ones, of n_frames in total, or the mean number of updates
+#   of the previous decompositions), save more than the extra cost of the decomposition.
+# The counters report how often each case happened
+class persistence_vineyard():
+    def __init__(self, num_ROI, ets_vertices, triplets_edges, max_transpositions, reducer, n_frames=1):
+        self.N_nodes, self.N_edges = num_ROI, len(ets_vertices)
+        self.N_simplices = num_ROI + len(ets_vertices) + len(triplets_edges)
+        # Faces of each simplex (ids: nodes, then edges, then triangles)
+        self.faces = ([[] for i in range(num_ROI)] + np.asarray(ets_vertices, dtype=np.int64).tolist() +
+                      (num_ROI + np.asarray(triplets_edges, dtype=np.int64)).tolist())
+        self.max_transpositions = max_transpositions
+        self.reducer = reducer
+        self.n_frames_total = n_frames
+
+        # Current filtration (if decomposed all the ids sorted, otherwise only the included ones) and, if decomposed,
+        # position of each id and its decomposition: R and V are dictionaries id -> set of ids (a missing column of R
+        # is zero, a missing column of V is the identity)
+        self.order = None
+        self.decomposed = False
+        self.position = None
+        self.R, self.V = {}, {}
+        self.low, self.low_inverse = {}, {}
+
+        # Costs (seconds) of a reduction of the default mode, of a transposition, of the reading of the diagram from R,
+        # of a reduction building R and V and of the count of the transpositions, updated with the times measured on
+        # the frames (None until measured)
+        self.cost_reduction = None
+        self.cost_transposition = VINEYARD_TRANSPOSITION_COST
+        self.cost_diagram = 0
+        self.cost_decomposition = None
+        self.cost_counting = 0
+        self.n_decompositions = 0
+
+        # Counters: frames, frames updated with transpositions, full reductions (after the first frame), total number
+        # of transpositions
+        self.n_frames = 0
+        self.n_updates = 0
+        self.n_fallbacks = 0
+        self.n_transpositions = 0
+
+    # Function that returns the dimension of a simplex from its id
+    def dimension(self, simplex):
+        return(0 if simplex < self.N_nodes else 1 if simplex < self.N_nodes + self.N_edges else 2)
+
+    # Function that returns the estimated costs of a reduction from scratch and of a reduction building R and V (before
+    # the first decomposition, VINEYARD_DECOMPOSITION_RATIO times the reduction from scratch)
+    def costs_estimate(self):
+        cost_decomposition = self.cost_decomposition
+        if cost_decomposition is None:
+            cost_decomposition = VINEYARD_DECOMPOSITION_RATIO * self.cost_reduction
+        return(self.cost_reduction, cost_decomposition)
+
+    # Function that returns the estimated cost of an update with n_transpositions
+    def update_cost(self, n_transpositions):
+        return(n_transpositions * self.cost_transposition + self.cost_diagram)
+
+    # Function that tells whether building R and V for the current frame is expected to pay off over the frames it
+    # lasts, if each of them needs n_transpositions (with None, in the best case of no transposition)
+    def decomposition_pays_off(self, n_transpositions=None):
+        cost_reduction, cost_decomposition = self.costs_estimate()
+        saving = cost_reduction - self.update_cost(n_transpositions or 0) - self.cost_counting
+        n_frames = self.n_frames_total - self.n_frames
+        if self.n_decompositions > 0:
+            n_frames = min(n_frames, self.n_updates / self.n_decompositions)
+        return(saving > 0 and n_frames * saving > cost_decomposition - cost_reduction)
+
+    # Function that returns all the ids sorted as in the filtration with the included ones simplices_ids (the others
+    # are appended in order of id)
+    def complete_order(self, simplices_ids):
+        included = np.zeros(self.N_simplices, dtype=bool)
+        included[simplices_ids] = True
+        return(np.concatenate((simplices_ids, np.flatnonzero(~included))))
+
+    # Function that computes the persistence diagram in dimension 1 of the integer-coded filtration (sorted ids, weights),
+    # as compute_persistence_diagram of simplicial_complex_mvts (same output)
+    def compute_persistence_diagram(self, filtration):
+        simplices_ids, weights = filtration
+        self.n_frames += 1
+
+        # Transpositions from the previous frame (counted only if they may be used)
+        n_transpositions = None
+        if self.order is not None and (self.decomposed or self.decomposition_pays_off()):
+            # Rank in the new filtration of the simplices, in the current order
+            start = time.perf_counter()
+            order = self.complete_order(simplices_ids)
+            rank = np.empty(self.N_simplices, dtype=np.int64)
+            rank[order] = np.arange(self.N_simplices)
+            current_rank = rank[self.order if self.decomposed else self.complete_order(self.order)]
+            n_transpositions = count_inversions(current_rank)
+            self.cost_counting = time.perf_counter() - start
+        affordable = n_transpositions is not None and n_transpositions <= self.max_transpositions
+
+        if self.decomposed and affordable and self.update_cost(n_transpositions) < self.cost_reduction:
+            self.n_updates += 1
+            self.n_transpositions += n_transpositions
+            start = time.perf_counter()
+            self.update(current_rank)
+            if n_transpositions > 0:
+                self.cost_transposition = (time.perf_counter() - start) / n_transpositions
+            return(self.timed_diagram(len(simplices_ids), weights))
+
+        if self.order is not None:
+            self.n_fallbacks += 1
+        if affordable and self.decomposition_pays_off(n_transpositions):
+            start = time.perf_counter()
+            self.reduce(order)
+            self.cost_decomposition = time.perf_counter() - start
+            self.n_decompositions += 1
+            return(self.timed_diagram(len(simplices_ids), weights))
+        # Reduction of the default mode, R and V are not kept
+        self.order, self.decomposed = np.asarray(simplices_ids), False
+        self.R, self.V, self.low, self.low_inverse = {}, {}, {}, {}
+        start = time.perf_counter()
+        dgms = self.reducer(filtration)
+        self.cost_reduction = time.perf_counter() - start
+        return(dgms)
+
+    # Function that reads the persistence diagram from R (see diagram), measuring its cost
+    def timed_diagram(self, n_included, weights):
+        start = time.perf_counter()
+        dgms = {1: self.diagram(n_included, np.asarray(weights, dtype=np.float64))}
+        self.cost_diagram = time.perf_counter() - start
+        return(dgms)
+
+    # Function that reduces from scratch the boundary matrix of the filtration given by order (ids sorted).
+    # The triangles are reduced before the edges, so that the edges killed by a triangle are cleared (twist)
+    def reduce(self, order):
+        self.order = order.tolist()
+        self.decomposed = True
+        self.position = [0] * self.N_simplices
+        for p, simplex in enumerate(self.order):
+            self.position[simplex] = p
+        self.R, self.V, self.low, self.low_inverse = {}, {}, {}, {}
+
+        # During the reduction the columns of R are bitsets (one bit for each position)
+        reduced_columns, pivots = {}, {}
+        triangles = [s for s in self.order if s >= self.N_nodes + self.N_edges]
+        edges = [s for s in self.order if self.N_nodes <= s < self.N_nodes + self.N_edges]
+        for simplex in triangles + edges:
+            if simplex in self.low_inverse:
+                # Cleared: the column of the triangle killing this edge is a cycle ending with it
+                self.V[simplex] = set(self.R[self.low_inverse[simplex]])
+                continue
+            column = bitset(self.position[face] for face in self.faces[simplex])
+            chain = {simplex}
+            while column:
+                pivot = column.bit_length() - 1
+                if pivot not in pivots:
+                    break
+                column ^= reduced_columns[pivots[pivot]]
+                chain ^= self.V.get(pivots[pivot], {pivots[pivot]})
+            if len(chain) > 1:
+                self.V[simplex] = chain
+            if column:
+                reduced_columns[simplex] = column
+                pivots[pivot] = simplex
+                self.R[simplex] = set(self.order[p] for p in bitset_entries(column))
+                self.low[simplex] = self.order[pivot]
+                self.low_inverse[self.order[pivot]] = simplex
+
+    # Function that moves the current filtration to the new one (given the new rank of the simplices in the current
+    # order) sorting it with transpositions of consecutive simplices (insertion sort). Only the simplices whose new
+    # rank is lower than the one of a simplex before them move
+    def update(self, current_rank):
+        moving = np.flatnonzero(current_rank[1:] < np.maximum.accumulate(current_rank)[:-1]) + 1
+        current_rank = current_rank.tolist()
+        for j in moving.tolist():
+            i = j
+            while i > 0 and current_rank[i - 1] > current_rank[i]:
+                self.transpose(i - 1)
+                current_rank[i - 1], current_rank[i] = current_rank[i], current_rank[i - 1]
+                i -= 1
+
+    # Function that swaps the simplices in position i and i+1 keeping R = D V reduced and V upper triangular
+    def transpose(self, i):
+        sigma, tau = self.order[i], self.order[i + 1]
+        affected = [sigma, tau]
+        if self.dimension(sigma) == self.dimension(tau):
+            # Columns killing sigma and tau
+            k, l = self.low_inverse.get(sigma), self.low_inverse.get(tau)
+            affected += [c for c in [k, l] if c is not None]
+            sigma_negative, tau_negative = sigma in self.R, tau in self.R
+            # sigma in the column of tau in V: after the swap V would not be upper triangular
+            v = sigma in self.V.get(tau, ())
+
+            if not sigma_negative and not tau_negative:
+                if v:
+                    self.add_column(sigma, tau)
+                # Both sigma and tau are killed, and the column killing tau contains sigma: after the swap the two
+                # columns would have the same low, so the younger one is reduced with the older one
+                if k is not None and l is not None and sigma in self.R[l]:
+                    if self.position[k] < self.position[l]:
+                        self.add_column(k, l)
                     else:
-                        violation_triangles_negativeterms += 1
+                        self.add_column(l, k)
+            elif sigma_negative and tau_negative:
+                if v:
+                    swap_pairs = self.position[self.low[sigma]] > self.position[self.low[tau]]
+                    self.add_column(sigma, tau)
+                    if swap_pairs:
+                        # (after the swap tau comes first)
+                        self.add_column(tau, sigma)
+            elif sigma_negative:
+                if v:
+                    self.add_column(sigma, tau)
+                    self.add_column(tau, sigma)
+            elif v:
+                self.add_column(sigma, tau)
+
+        # Swap and update the lows of the columns involved
+        self.order[i], self.order[i + 1] = tau, sigma
+        self.position[sigma], self.position[tau] = i + 1, i
+        for c in affected:
+            if c in self.low and self.low_inverse.get(self.low[c]) == c:
+                del self.low_inverse[self.low[c]]
+            self.low.pop(c, None)
+        for c in affected:
+            if c in self.R:
+                self.low[c] = max(self.R[c], key=self.position.__getitem__)
+                self.low_inverse[self.low[c]] = c
+
+    # Function that adds the column source to the column target, in R and V
+    def add_column(self, source, target):
+        column = self.R.get(target, set()) ^ self.R.get(source, set())
+        if column:
+            self.R[target] = column
+        else:
+            self.R.pop(target, None)
+        self.V[target] = self.V.get(target, {target}) ^ self.V.get(source, {source})
 
-        # Fraction of positive triangle discarderd (a.k.a. the hyper coherence)
-        hyper_coherence = (1.0 * violation_triangles) / \
-            (triangles_count + violation_triangles)
-        return(list_simplices_for_filtration, list_violating_triangles, hyper_coherence)
+    # Function that reads the persistence diagram in dimension 1 (only the first n_included simplices are in the
+    # filtration of the frame, with the given weights): finite points sorted by birth, without the zero persistence
+    # pairs, then the positive edges never killed
+    def diagram(self, n_included, weights):
+        births, deaths, essential = [], [], []
+        for edge in range(self.N_nodes, self.N_nodes + self.N_edges):
+            if edge in self.R:
+                continue
+            killer = self.low_inverse.get(edge)
+            if killer is not None and self.position[killer] < n_included:
+                births.append(self.position[edge])
+                deaths.append(self.position[killer])
+            else:
+                essential.append(self.position[edge])
+        births, deaths = np.array(births, dtype=np.int64), np.array(deaths, dtype=np.int64)
+        sorting = np.argsort(births)
+        births, deaths = births[sorting], deaths[sorting]
+        finite = weights[births] != weights[deaths]
+        essential = np.sort(np.array(essential, dtype=np.int64))
+        return(np.concatenate((np.column_stack((weights[births[finite]], weights[deaths[finite]])),
+                               np.column_stack((weights[essential], np.full(len(essential), np.inf))))))
 
 
 # Function that checks for the pure coherence rule (1 if it is fully coherent, -1 otherwise)
 def coherence_function(vector):
-    n = len(vector)
-    temp = 0
-    for el in vector:
-        temp += np.sign(el)
+    # It also accepts arrays of simplices, where the last axis contains the signals of the vertices
+    vector = np.asarray(vector)
+    n = np.shape(vector)[-1]
+    temp = np.sum(np.sign(vector), axis=-1)
     exponent = np.sign(n - np.abs(temp))
     res = (-1)**exponent
     return(res)
@@ -376,17 +1631,341 @@ def compute_persistence_diagram_cechmate(list_simplices_all):
     return(dgms)
 
 
+# Function that returns the M directions used by the sliced Wasserstein distance, as in persim.sliced_wasserstein
+# (angles theta*pi with theta from 0.5 in steps of 1/M, stored in float32)
+def sliced_wasserstein_directions(M=50):
+    directions = []
+    theta = 0.5
+    step = 1.0 / M
+    for i in range(M):
+        directions.append([np.cos(theta * np.pi), np.sin(theta * np.pi)])
+        theta += step
+    return(np.array(directions, dtype=np.float32))
+
+
+# Directions shared by all the time points
+SLICED_WASSERSTEIN_DIRECTIONS = sliced_wasserstein_directions(SLICED_WASSERSTEIN_M)
+
+
+# Function that computes the hyper-complexity indicators of the (cleaned) persistence diagram: the sliced Wasserstein
+# distance with the empty diagram of the whole diagram and of its Fully Coherent, Coherent Transition and Fully
+# Decoherence contributions. The points and their projections on the diagonal are projected only once on the shared
+# directions, and the four distances are read from the same projections. The values are the ones of
+# persim.sliced_wasserstein(..., np.array([])) with the same directions, up to the rounding of the last digit
+# (persim projects each point with np.dot, which may use fused multiply-add).
+# If order is given, the indicators are instead the exact Wasserstein distances of that order with the empty diagram:
+# every point is matched to the diagonal, at its shortest (Euclidean) distance |death - birth| / sqrt(2), and
+# W_p = (sum of the distances^p)^(1/p) (order=np.inf gives the largest distance). The Julia implementation (-w)
+# measures the same matching with the hypotenuse |death - birth|, so its values are sqrt(2) times these ones
+def compute_hyper_complexity(dgm, directions=SLICED_WASSERSTEIN_DIRECTIONS, order=None):
+    # Since the signs of the persistence diagram are flipped,
+    # then Fully Coherent contributes identify points with birth and death <=0,
+    # Coherent Transition contributes identify points with birth < 0 and death > 0,
+    # Fully Decoherence contributes identify points with birth > 0 and death > 0
+    subsets = [np.ones(len(dgm), dtype=bool),
+               (dgm[:, 0] < 0) & (dgm[:, 1] <= 0),
+               (dgm[:, 0] < 0) & (dgm[:, 1] > 0),
+               (dgm[:, 0] > 0) & (dgm[:, 1] > 0)]
+
+    if order is not None:
+        distance = np.abs(dgm[:, 1] - dgm[:, 0]) / np.sqrt(2.0)
+        if np.isinf(order):
+            return([float(np.max(distance[subset], initial=0.0)) for subset in subsets])
+        return([float(np.sum(distance[subset] ** order) ** (1.0 / order)) for subset in subsets])
+
+    step = 1.0 / len(directions)
+    diagonal = np.array([np.cos(0.25 * np.pi), np.sin(0.25 * np.pi)], dtype=np.float32)
+    # Projection of the points on the diagonal, and of the points and of these projections on each direction
+    # (one row for each direction)
+    x = dgm[:, 0] * diagonal[0] + dgm[:, 1] * diagonal[1]
+    delta = np.sqrt(x ** 2 / 2.0)
+    points_projected = directions[:, 0:1] * dgm[:, 0] + directions[:, 1:2] * dgm[:, 1]
+    delta_projected = directions[:, 0:1] * delta + directions[:, 1:2] * delta
+
+    complexity = []
+    for subset in subsets:
+        cost = np.sum(np.abs(np.sort(points_projected[:, subset], axis=1) - np.sort(delta_projected[:, subset], axis=1)),
+                      axis=1)
+        # Summed direction after direction, as in persim
+        complexity.append(np.cumsum(step * cost)[-1])
+    return(complexity)
+
+
+# Approximate sparse mode: function that returns a lower bound of the hyper complexity (whole diagram) of the exact
+# filtration, from the (cleaned) diagram of the sparse one and the weight of its first dropped triangle (cutoff).
+# The two filtrations are the same up to the cutoff, and have the same edges: the points are born at the same time,
+# those dying before the cutoff are exact, and the others die earlier in the exact filtration, but not before the
+# cutoff. So the exact value is between the one of the diagram with these deaths moved back to the cutoff (returned)
+# and the one of the sparse diagram. The bound holds for the exact Wasserstein distances (order), which grow with the
+# persistence of each point, while for the sliced one it is an estimate
+def hyper_complexity_lower_bound(dgm, cutoff, order=None):
+    dgm = np.array(dgm, dtype=np.float64).reshape(-1, 2)
+    uncertain = dgm[:, 1] >= cutoff
+    dgm[uncertain, 1] = np.maximum(dgm[uncertain, 0], cutoff)
+    return(compute_hyper_complexity(dgm, order=order)[0])
+
 # Computing the edge weights from the violating triangles
-# (it also keeps the count of the number triangles one edge belongs to)    
-def compute_edgeweight(list_violations, num_ROI):
-    Nviolations = len(list_violations)
-    edge_weight = {}
-    for element in list_violations:
-        triplets, weight, _ = element
-        for edgeID in itertools.combinations(triplets, 2):
-            if edgeID in edge_weight:
-                edge_weight[edgeID] = np.add(
-                    edge_weight[edgeID], [weight, 1.0])
-            else:
-                edge_weight[edgeID] = [weight, 1.0]
-    return(edge_weight)
+# (it also keeps the count of the number triangles one edge belongs to).
+# The output is an array with rows [i, j, sum of the weights, number of triangles], in order of first appearance
+def compute_edgeweight(list_violations, num_ROI, backend='numpy'):
+    triplets, weight, _ = list_violations
+    if backend == 'numba':
+        return(edgeweight_kernel(np.asarray(triplets), np.asarray(weight), num_ROI))
+    # Edges of each triangle (ij, ik, jk), one after the other
+    edges = np.asarray(triplets)[:, [[0, 1], [0, 2], [1, 2]]].reshape(-1, 2)
+    edges_id = edge_index(edges[:, 0], edges[:, 1], num_ROI)
+    unique_edges, first_position, inverse = np.unique(edges_id, return_index=True, return_inverse=True)
+    edge_weight = np.zeros((len(unique_edges), 4))
+    edge_weight[:, 0:2] = edges[first_position]
+    np.add.at(edge_weight[:, 2], inverse, np.repeat(weight, 3))
+    edge_weight[:, 3] = np.bincount(inverse, minlength=len(unique_edges))
+    return(edge_weight[np.argsort(first_position)])
+
+
+# Function that checks the rule and the value of the approximate sparse mode (-x): 'quantile' needs 0 < value <= 1,
+# 'topk' a positive integer number of edges, not larger than N_edges (if given)
+def check_sparse(sparse, N_edges=None):
+    rule, value = sparse
+    if rule not in SPARSE_RULES:
+        raise ValueError("Unknown sparse rule '{0}' (-x): use one of {1}".format(rule, ', '.join(SPARSE_RULES)))
+    if rule == 'quantile' and not 0 < value <= 1:
+        raise ValueError("The value of the sparse rule 'quantile' (-x) must be in (0, 1], not {0}".format(value))
+    if rule == 'topk' and (value < 1 or not float(value).is_integer()):
+        raise ValueError("The value of the sparse rule 'topk' (-x) must be a positive integer, not {0}".format(value))
+    if rule == 'topk' and N_edges is not None and value > N_edges:
+        raise ValueError("The value of the sparse rule 'topk' (-x) must not be larger than the number of edges ({0}), "
+                         "not {1}".format(N_edges, value))
+
+
+# Function that selects the time points whose hyper coherence passes the rule given with -k: 'top' ('bottom') keeps
+# the given fraction of the time points with the highest (lowest) values, as the 'top_percent' scenario of the
+# orchestration, 'above' ('below') the time points with a value >= (<=) the given threshold
+def select_time_points(t_list, values, rule, value):
+    t_list, values = np.asarray(t_list), np.asarray(values)
+    if rule == 'above':
+        selected = t_list[values >= value]
+    elif rule == 'below':
+        selected = t_list[values <= value]
+    else:
+        n_selected = int(np.ceil(len(t_list) * value))
+        order = np.argsort(values, kind='stable')
+        selected = t_list[order[len(order) - n_selected:]] if rule == 'top' else t_list[order[:n_selected]]
+    return(sorted(selected.tolist()))
+
+
+# Function that returns the time points to compute in the next round of the adaptive sampling (-a): the midpoint of
+# each interval between consecutive computed time points (dictionary t -> indicators) where any indicator changes by
+# more than tolerance, relative to the largest of the two values (the indicators that are nan are not compared)
+def refine_time_points(computed, tolerance):
+    t_computed = sorted(computed)
+    t_refined = []
+    for t_a, t_b in zip(t_computed[:-1], t_computed[1:]):
+        if t_b - t_a > 1:
+            a, b = np.asarray(computed[t_a], dtype=float), np.asarray(computed[t_b], dtype=float)
+            if np.any(np.abs(a - b) > tolerance * np.maximum(np.abs(a), np.abs(b))):
+                t_refined.append((t_a + t_b) // 2)
+    return(t_refined)
+
+
+# Function that updates, for each edge, the first of the triangles containing it in the order given by the keys
+# (lexicographic order, the first of the n_keys columns is the most significant). current holds, for each edge, all the
+# columns of its current first triangle, and missing marks the edges without triangles yet. The triangles are streamed
+# by increasing rank, so a later one replaces the current one only if its first key is strictly smaller
+def update_first_triangles(current, missing, edges, columns, n_keys):
+    order = np.lexsort(tuple(columns[n_keys - 1::-1]) + (edges,))
+    edges_sorted = edges[order]
+    first = order[np.concatenate(([True], edges_sorted[1:] != edges_sorted[:-1]))]
+    replace = missing[edges[first]] | (columns[0][first] < current[0][edges[first]])
+    first = first[replace]
+    for array, column in zip(current, columns):
+        array[edges[first]] = column[first]
+    missing[edges[first]] = False
+
+
+# Function that maps float values to uint64 keys sorted in the same order, as np.argsort does
+# (-0.0 equal to 0.0, and nan after all the other values)
+def sortable_float_keys(values):
+    values = np.asarray(values, dtype=np.float64) + 0.0
+    bits = values.view(np.int64)
+    keys = np.where(bits < 0, bits ^ np.int64(0x7FFFFFFFFFFFFFFF), bits).view(np.uint64) ^ np.uint64(1 << 63)
+    keys[np.isnan(values)] = np.iinfo(np.uint64).max
+    return(keys)
+
+
+# Function that returns the float values of the keys given by sortable_float_keys (nan for the key of nan)
+def sortable_float_values(keys):
+    bits = (np.asarray(keys, dtype=np.uint64) ^ np.uint64(1 << 63)).view(np.int64)
+    return(np.where(bits < 0, bits ^ np.int64(0x7FFFFFFFFFFFFFFF), bits).view(np.float64))
+
+
+# Function that splits a sorted list of time points into blocks of at most block_size contiguous time points
+def contiguous_blocks(t_list, block_size):
+    blocks = []
+    for t in t_list:
+        if blocks and t == blocks[-1][-1] + 1 and len(blocks[-1]) < block_size:
+            blocks[-1].append(t)
+        else:
+            blocks.append([t])
+    return(blocks)
+
+
+# Function that returns the mean and the sum of the squared deviations of each row of data, as the running statistics
+# of Welford's algorithm (float64)
+def welford_statistics(data):
+    data = np.asarray(data, dtype=np.float64)
+    mean = np.mean(data, axis=1)
+    return(mean, np.sum((data - mean[:, None])**2, axis=1))
+
+
+# Function that adds (sign 1) or removes (sign -1) the values of a new frame to the running mean and sum of the squared
+# deviations (in place), n being the number of frames after the update (Welford's algorithm)
+def welford_update(mean, M2, values, n, sign=1):
+    delta = values - mean
+    mean += sign * delta / n
+    M2 += sign * delta * (values - mean)
+
+
+# Function that returns the standard deviation (ddof=0, as zscore) from the running sum of the squared deviations of
+# n frames (the rounding of the removals could make it slightly negative)
+def welford_std(M2, n):
+    return(np.sqrt(np.maximum(M2, 0) / n))
+
+
+# Function that returns the bitset (python int) with the bits in the list of entries set to 1
+def bitset(entries):
+    bits = 0
+    for entry in entries:
+        bits |= 1 << entry
+    return(bits)
+
+
+# Function that returns the list of the bits set to 1 in a bitset (python int), in increasing order
+def bitset_entries(bits):
+    entries = []
+    while bits:
+        lowest = bits & -bits
+        entries.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return(entries)
+
+
+# Function that returns the number of inversions of a permutation of 0, ..., n-1, i.e. the number of transpositions
+# of consecutive elements needed to sort it (from the Kendall tau with the identity, no ties)
+def count_inversions(permutation):
+    n = len(permutation)
+    if n < 2:
+        return(0)
+    tau = kendalltau(permutation, np.arange(n))[0]
+    return(int(round((1 - tau) * n * (n - 1) / 4)))
+
+
+# Function that returns the index of the edges (i,j), with i<j, in the order given by np.triu_indices
+def edge_index(i, j, num_ROI):
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    return(i * (2 * num_ROI - i - 1) // 2 + j - i - 1)
+
+
+# Function that returns the smallest signed integer type (at least int16) able to store all the values in [0, max_value]
+def compact_int_dtype(max_value):
+    for int_type in [np.int16, np.int32]:
+        if max_value <= np.iinfo(int_type).max:
+            return(int_type)
+    return(np.int64)
+
+
+# Function that returns the binomial coefficient C(n, k) as an exact integer
+def n_choose_k(n, k):
+    return(math.comb(n, k) if 0 <= k <= n else 0)
+
+
+# Function that returns the table of the binomial coefficients C(m, j), for m in [0, n] and j in [0, k] (int64),
+# column by column from C(m, j) = sum_{i<m} C(i, j-1)
+def binomial_table(n, k):
+    table = np.zeros((n + 1, k + 1), dtype=np.int64)
+    table[:, 0] = 1
+    for j in range(1, k + 1):
+        table[1:, j] = np.cumsum(table[:-1, j - 1])
+    return(table)
+
+
+# Function that returns the rank of the k-simplices (rows of vertices, sorted i<j<...) among all the k-subsets of
+# num_ROI nodes in lexicographic order (combinatorial number system): C(N,k) - 1 - sum_i C(N-1-c_i, k-i)
+def simplex_rank(vertices, num_ROI):
+    vertices = np.asarray(vertices, dtype=np.int64)
+    k = vertices.shape[-1]
+    table = binomial_table(num_ROI, k)
+    rank = np.full(vertices.shape[:-1], table[num_ROI, k] - 1, dtype=np.int64)
+    for i in range(k):
+        rank -= table[num_ROI - 1 - vertices[..., i], k - i]
+    return(rank)
+
+
+# Function that returns the vertices (sorted i<j<...) of the k-simplices with the given lexicographic ranks,
+# i.e. the inverse of simplex_rank
+def simplex_unrank(ranks, num_ROI, k):
+    table = binomial_table(num_ROI, k)
+    remainder = table[num_ROI, k] - 1 - np.asarray(ranks, dtype=np.int64)
+    vertices = np.empty(remainder.shape + (k,), dtype=np.int64)
+    for i in range(k):
+        # Largest m with C(m, k-i) <= remainder (the column is non decreasing in m)
+        m = np.searchsorted(table[:num_ROI, k - i], remainder, side='right') - 1
+        vertices[..., i] = num_ROI - 1 - m
+        remainder -= table[m, k - i]
+    return(vertices)
+
+
+# Compiled kernels of the 'numba' backend (-e), giving the same results of the array operations they replace
+# (without the GIL, so that the threads of the option -i run them in parallel)
+if numba is not None:
+    # Weights of a set of simplices (rows of vertices, mean and std of their products in statistics) for the columns
+    # of the signals x, written in weights: as compute_products_weights, with the coherence from the signs of x
+    # (zeros are never coherent, as in the sign planes)
+    @numba.njit(cache=True, nogil=True)
+    def products_weights_kernel(x, vertices, statistics, weights):
+        n_simplices, k = vertices.shape
+        for s in range(n_simplices):
+            for c in range(x.shape[1]):
+                product = x[vertices[s, 0], c]
+                positive = product > 0
+                negative = product < 0
+                for i in range(1, k):
+                    value = x[vertices[s, i], c]
+                    product = product * value
+                    positive = positive and value > 0
+                    negative = negative and value < 0
+                weight = abs((product - statistics[s, 0]) / statistics[s, 1])
+                weights[s, c] = weight if positive or negative else -weight
+
+    # Number of edges entered before each triangle (rows of triplets_edges) in each column of rank (integer-coded
+    # simplices: nodes, edges and then triplets, the first of the given triangles being the row first), written in
+    # edges_present: as in find_violations_block
+    @numba.njit(cache=True, nogil=True)
+    def edges_present_kernel(rank, triplets_edges, N_nodes, first, edges_present):
+        for s in range(triplets_edges.shape[0]):
+            for c in range(rank.shape[1]):
+                count = 0
+                for i in range(3):
+                    if rank[N_nodes + triplets_edges[s, i], c] < rank[first + s, c]:
+                        count += 1
+                edges_present[s, c] = count
+
+    # Projection of the violating triangles on the edges, as compute_edgeweight: the rows of the edges are created in
+    # order of first appearance, then the weights and the counts are accumulated
+    @numba.njit(cache=True, nogil=True)
+    def edgeweight_kernel(triplets, weight, num_ROI):
+        position = np.full(num_ROI * (num_ROI - 1) // 2, -1, dtype=np.int64)
+        edge_weight = np.zeros((3 * triplets.shape[0], 4))
+        n = 0
+        for s in range(triplets.shape[0]):
+            for a, b in ((0, 1), (0, 2), (1, 2)):
+                i, j = np.int64(triplets[s, a]), np.int64(triplets[s, b])
+                e = i * (2 * num_ROI - i - 1) // 2 + j - i - 1
+                if position[e] < 0:
+                    position[e] = n
+                    edge_weight[n, 0] = i
+                    edge_weight[n, 1] = j
+                    n += 1
+                edge_weight[position[e], 2] += weight[s]
+                edge_weight[position[e], 3] += 1
+        return(edge_weight[:n])
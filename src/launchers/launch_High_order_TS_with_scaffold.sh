@@ -32,6 +32,8 @@ codepath="simplicial_multivariate.py"
 filename="../Input/lorenzo_data/cortical_subcortical/${subject}_ts_zscore_ctx_sub.txt"
 javaplexpath="javaplex/javaplex.jar"
 outtag="scaffold_"
+# Statistics of edges and triplets shared by all the array tasks of the subject (computed once)
+cachedir="../Output/lorenzo_data/${subject}/stats_cache"
 
 # Current time of the arry
 t=$((SLURM_ARRAY_TASK_ID + offset))
@@ -62,7 +64,7 @@ fi
 echo "---- Starting scaffold subject=${subject}, t=${t} ----"
 date
 
-if python "${codepath}" "${filename}" -t "${t}" "${tnext}" -p 1 -j "${javaplexpath}" "${outtag}"; then
+if python "${codepath}" "${filename}" -t "${t}" "${tnext}" -p 1 -c "${cachedir}" -j "${javaplexpath}" "${outtag}"; then
     # Sposta SOLO il file generato da questo t
     if [ -f "scaffold_gen/generators__${t}.pck" ]; then
         mv "scaffold_gen/generators__${t}.pck" "${outdir}/"
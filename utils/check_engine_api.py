@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Utility script to validate the library API of High_order_TS (higher_order_engine).
+
+Runs simplicial_multivariate.py from the command line on the input, then
+computes the same time points in-process with higher_order_engine: first
+lazily with iter_frames (with the threads of -i), then with run(parallel=2)
+on the same engine, whose Pool workers are forked after the threads were used.
+The indicators of the three runs must be identical. Two engines (the whole
+data and its first half of ROI) are then iterated at the same time from two
+threads, and each must give the same frames as when iterated alone. A run
+that does not end within the timeout (e.g. a Pool worker waiting on a thread
+pool inherited from the parent process) is reported as a failure.
+
+Usage:
+    python check_engine_api.py [<input_file>] [-t t0 T] [-i #threads] [-d #order]
+
+Defaults:
+    input_file      Input/trial_N50_T240_r175_eps012_008_03_0068_005.txt_kaneko
+    -t 0 12, -i 2, -d 3
+"""
+
+import signal
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent
+CODE_PATH = ROOT_DIR / "High_order_TS" / "simplicial_multivariate.py"
+sys.path.insert(0, str(CODE_PATH.parent))
+from simplicial_multivariate import higher_order_engine, INDICATOR_NAMES  # noqa: E402
+from utils import load_data  # noqa: E402
+
+DEFAULT_INPUT = ROOT_DIR / "Input" / "trial_N50_T240_r175_eps012_008_03_0068_005.txt_kaneko"
+TIMEOUT = 300
+
+
+def frame_row(frame):
+    """Return the indicators of a frame of the engine, in the order of the columns of the command line."""
+    return [frame[name] for name in frame if name != "edge_weights"]
+
+
+def iterate_concurrently(engines, t_list):
+    """Iterate the engines at the same time, one thread each, and return their frames."""
+    results = [None] * len(engines)
+
+    def iterate(c):
+        results[c] = np.array([frame_row(frame) for frame in engines[c].iter_frames(t_list)], dtype=float)
+    threads = [threading.Thread(target=iterate, args=(c,)) for c in range(len(engines))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def timeout_handler(signum, frame):
+    sys.exit(f"The engine did not end within {TIMEOUT} s: FAIL")
+
+
+def main():
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print(__doc__)
+        sys.exit(0)
+
+    input_file = DEFAULT_INPUT
+    t_init, t_end, threads, max_order = 0, 12, 2, 3
+    args = sys.argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg == "-t":
+            t_init, t_end = int(args.pop(0)), int(args.pop(0))
+        elif arg == "-i":
+            threads = int(args.pop(0))
+        elif arg == "-d":
+            max_order = int(args.pop(0))
+        else:
+            input_file = Path(arg).resolve()
+
+    run = subprocess.run([sys.executable, str(CODE_PATH), str(input_file), "-t", str(t_init), str(t_end),
+                          "-d", str(max_order)], cwd=CODE_PATH.parent, check=True, capture_output=True, text=True)
+    reference = np.array([[float(el) for el in line.split()] for line in run.stdout.splitlines() if line.strip()])
+    reference = reference[np.argsort(reference[:, 0])]
+
+    signal.signal(signal.SIGALRM, timeout_handler)
+    signal.alarm(TIMEOUT)
+    with higher_order_engine(str(input_file), {"threads": threads, "max_order": max_order}) as engine:
+        lazy = np.array([frame_row(frame) for frame in engine.iter_frames(range(t_init, t_end))], dtype=float)
+        parallel = np.array([frame_row(frame) for frame in engine.run(range(t_init, t_end), parallel=2)], dtype=float)
+        data = load_data(str(input_file))
+        engines = [engine, higher_order_engine(data, {"max_order": max_order}, rois=np.arange(data.shape[0] // 2))]
+        alone = [np.array([frame_row(frame) for frame in e.iter_frames(range(t_init, t_end))], dtype=float)
+                 for e in engines]
+        concurrent = iterate_concurrently(engines, range(t_init, t_end))
+    signal.alarm(0)
+
+    print(f"higher_order_engine vs command line ({input_file.name}, t={t_init}..{t_end}, -i {threads}, -d {max_order}):")
+    all_passed = True
+    for name, results in [("iter_frames", lazy), ("run(parallel=2)", parallel)]:
+        passed = np.array_equal(results, reference, equal_nan=True)
+        print(f"  {name:<24} {'identical' if passed else 'DIFFERENT'}")
+        all_passed &= passed
+    passed = all(np.array_equal(a, c, equal_nan=True) for a, c in zip(alone, concurrent))
+    print(f"  {'two engines in threads':<24} {'identical' if passed else 'DIFFERENT'}")
+    all_passed &= passed
+    print(f"  ({len(INDICATOR_NAMES)} indicators and {reference.shape[1] - len(INDICATOR_NAMES)} higher-order columns "
+          f"for {reference.shape[0]} time points)")
+
+    sys.exit(0 if all_passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Utility script to validate the single-precision mode of High_order_TS.
+
+Runs simplicial_multivariate.py on the same input twice, once in float64 and
+once with "-f float32", and compares the higher-order indicators frame by frame.
+If a reference file is given (by default the Kaneko sample stored in
+Sample_results), both runs are also checked against it.
+
+Usage:
+    python check_float32_tolerance.py [<input_file> <reference_file>] [-t t0 T] [-p #core]
+
+Defaults:
+    input_file      Input/trial_N50_T240_r175_eps012_008_03_0068_005.txt_kaneko
+    reference_file  Sample_results/results_T0_1200_N50.txt
+    -t 0 100, -p 1
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent
+CODE_PATH = ROOT_DIR / "High_order_TS" / "simplicial_multivariate.py"
+DEFAULT_INPUT = ROOT_DIR / "Input" / "trial_N50_T240_r175_eps012_008_03_0068_005.txt_kaneko"
+DEFAULT_REFERENCE = ROOT_DIR / "Sample_results" / "results_T0_1200_N50.txt"
+
+# Columns of the standard output and the tolerance accepted for the float32 mode:
+# (relative tolerance, absolute tolerance), a frame passes if either of the two is met
+COLUMNS = ["Hyper complexity", "Hyper complexity FC", "Hyper complexity CT",
+           "Hyper complexity FD", "Hyper coherence", "Average edge violation"]
+TOLERANCES = {
+    "Hyper complexity": (1e-4, 1e-3),
+    "Hyper complexity FC": (1e-4, 1e-3),
+    "Hyper complexity CT": (1e-4, 1e-3),
+    "Hyper complexity FD": (1e-4, 1e-3),
+    "Hyper coherence": (0, 1e-3),
+    "Average edge violation": (0, 1e-2),
+}
+
+
+def run_indicators(input_file: Path, t_init: int, t_end: int, ncores: int, dtype: str) -> np.ndarray:
+    """Run the engine and return the indicators sorted by time (one row per frame)."""
+    args = [sys.executable, str(CODE_PATH), str(input_file), "-t", str(t_init), str(t_end),
+            "-p", str(ncores), "-f", dtype]
+    out = subprocess.run(args, cwd=CODE_PATH.parent, check=True, capture_output=True, text=True).stdout
+    results = np.array([[float(el) for el in line.split()] for line in out.splitlines() if line.strip()])
+    return results[np.argsort(results[:, 0])]
+
+
+def compare(results: np.ndarray, reference: np.ndarray) -> Dict[str, Tuple[float, float, bool]]:
+    """Return, for each indicator, the max relative and absolute differences and whether they are within tolerance."""
+    report = {}
+    for c, name in enumerate(COLUMNS, start=1):
+        abs_diff = np.abs(results[:, c] - reference[:, c])
+        rel_diff = abs_diff / np.maximum(np.abs(reference[:, c]), np.finfo(float).tiny)
+        rtol, atol = TOLERANCES[name]
+        passed = bool(np.all((rel_diff <= rtol) | (abs_diff <= atol)))
+        report[name] = (float(np.max(rel_diff)), float(np.max(abs_diff)), passed)
+    return report
+
+
+def print_report(title: str, report: Dict[str, Tuple[float, float, bool]]) -> bool:
+    print(title)
+    for name, (rel_diff, abs_diff, passed) in report.items():
+        print(f"  {name:<24} max rel: {rel_diff:.3e}  max abs: {abs_diff:.3e}  {'OK' if passed else 'FAIL'}")
+    return all(passed for _, _, passed in report.values())
+
+
+def main():
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print(__doc__)
+        sys.exit(0)
+
+    positional = []
+    t_init, t_end, ncores = 0, 100, 1
+    args = sys.argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg == "-t":
+            t_init, t_end = int(args.pop(0)), int(args.pop(0))
+        elif arg == "-p":
+            ncores = int(args.pop(0))
+        else:
+            positional.append(Path(arg).resolve())
+    input_file = positional[0] if positional else DEFAULT_INPUT
+    reference_file = positional[1] if len(positional) > 1 else (None if positional else DEFAULT_REFERENCE)
+
+    results64 = run_indicators(input_file, t_init, t_end, ncores, "float64")
+    results32 = run_indicators(input_file, t_init, t_end, ncores, "float32")
+    all_passed = print_report(f"float32 vs float64 ({input_file.name}, t={t_init}..{t_end}):",
+                              compare(results32, results64))
+
+    if reference_file is not None:
+        reference = np.loadtxt(reference_file)
+        reference = reference[np.argsort(reference[:, 0])]
+        reference = reference[(reference[:, 0] >= t_init) & (reference[:, 0] < t_end)]
+        all_passed &= print_report(f"float64 vs {reference_file.name}:", compare(results64, reference))
+        all_passed &= print_report(f"float32 vs {reference_file.name}:", compare(results32, reference))
+
+    sys.exit(0 if all_passed else 1)
+
+
+if __name__ == "__main__":
+    main()
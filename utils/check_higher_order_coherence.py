@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Utility script to validate the violations of the higher orders (-d) of High_order_TS.
+
+For each frame, takes the weights of all the simplices up to max_order of
+simplicial_complex_mvts, sorts them together by descending weight (faces
+first) and builds the filtration one simplex at a time, as the original
+fix_violations did for the triangles: edges are always included, and a
+k-simplex is included only if its k faces are already in the set of the
+included simplices. The hyper coherence and the average number of missing
+faces of each order from 4 on must be equal to the ones of
+compute_higher_order_coherence, and the hyper coherence of the triangles to
+the one of the filtration (find_violations_block).
+
+The brute force is in pure python: use a few ROI (-r) and time points (-t).
+
+Usage:
+    python check_higher_order_coherence.py [<input_file>] [-t t0 T] [-r #ROI] [-d #order]
+
+Defaults:
+    input_file      Input/subject1_left.txt
+    -t 0 30, -r 9, -d 4
+"""
+
+import itertools
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR / "High_order_TS"))
+from utils import simplicial_complex_mvts, load_data, n_choose_k  # noqa: E402
+
+DEFAULT_INPUT = ROOT_DIR / "Input" / "subject1_left.txt"
+
+
+def brute_force_coherence(ts_simplicial, t):
+    """Return [hyper coherence, average missing faces] of each order from 3 to max_order, building the filtration."""
+    simplices, weights, orders = [], [], []
+    for k in range(2, ts_simplicial.max_order + 1):
+        N_simplices = n_choose_k(ts_simplicial.num_ROI, k)
+        simplices += [tuple(int(v) for v in vertices) for vertices in ts_simplicial.simplices_vertices(k, 0, N_simplices)]
+        weights.append(ts_simplicial.order_weights(k, t))
+        orders += [k] * N_simplices
+    weights = np.concatenate(weights)
+    # (stable sort: at equal weight the faces come first, the nan weights last, as in find_violations_block)
+    included = set()
+    counters = {k: [0, 0, 0] for k in range(3, ts_simplicial.max_order + 1)}
+    for index in np.argsort(-weights, kind="stable"):
+        simplex, k = simplices[index], orders[index]
+        if k == 2:
+            included.add(simplex)
+            continue
+        present = sum(face in included for face in itertools.combinations(simplex, k - 1))
+        if present == k:
+            included.add(simplex)
+            if weights[index] >= 0:
+                counters[k][1] += 1
+        elif weights[index] >= 0:
+            counters[k][0] += 1
+            counters[k][2] += k - present
+    # (nan when there are no violating or no positive simplices, as in the engine)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return [[np.float64(n_violating) / (n_violating + n_valid_positive), np.float64(n_missing) / n_violating]
+                for n_violating, n_valid_positive, n_missing in counters.values()]
+
+
+def main():
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print(__doc__)
+        sys.exit(0)
+
+    input_file = DEFAULT_INPUT
+    t_init, t_end, n_rois, max_order = 0, 30, 9, 4
+    args = sys.argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg == "-t":
+            t_init, t_end = int(args.pop(0)), int(args.pop(0))
+        elif arg == "-r":
+            n_rois = int(args.pop(0))
+        elif arg == "-d":
+            max_order = int(args.pop(0))
+        else:
+            input_file = Path(arg).resolve()
+
+    ts_simplicial = simplicial_complex_mvts(load_data(str(input_file)), False, max_order=max_order,
+                                            rois=np.arange(n_rois))
+    n_different = 0
+    for t in range(t_init, t_end):
+        reference = brute_force_coherence(ts_simplicial, t)
+        hyper_coherence = ts_simplicial.create_simplicial_complex(t)[2]
+        engine = [hyper_coherence, np.nan] + ts_simplicial.compute_higher_order_coherence(t)
+        # (the average missing edges of the triangles are in the output of the filtration, not compared here)
+        same = np.allclose(reference[0][0], engine[0], rtol=0, atol=1e-12, equal_nan=True) and \
+            np.allclose(np.ravel(reference[1:]), engine[2:], rtol=0, atol=1e-12, equal_nan=True)
+        if not same:
+            n_different += 1
+            print(f"t={t}: brute force {np.ravel(reference).tolist()}  engine {engine}")
+
+    print(f"Orders 3..{max_order} on {n_rois} ROI of {input_file.name}, t={t_init}..{t_end}: "
+          f"{t_end - t_init - n_different} of {t_end - t_init} frames identical  {'OK' if n_different == 0 else 'FAIL'}")
+    sys.exit(0 if n_different == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
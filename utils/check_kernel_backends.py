@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Utility script to validate the kernel backends of High_order_TS.
+
+Runs simplicial_multivariate.py on the same input with "-e numpy" and with
+"-e numba", saving the projections of the violations on the edges (-s), and
+checks that the indicators and the projections of the two backends are
+identical frame by frame. Both backends are also checked against the same
+reference file (by default the Kaneko sample stored in Sample_results).
+Extra options (e.g. -l, -b 4, -f float32) are passed to both runs.
+
+Usage:
+    python check_kernel_backends.py [<input_file> <reference_file>] [-t t0 T] [-p #core] [<options>]
+
+Defaults:
+    input_file      Input/trial_N50_T240_r175_eps012_008_03_0068_005.txt_kaneko
+    reference_file  Sample_results/results_T0_1200_N50.txt
+    -t 0 40, -p 1
+"""
+
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+import h5py
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent
+CODE_PATH = ROOT_DIR / "High_order_TS" / "simplicial_multivariate.py"
+DEFAULT_INPUT = ROOT_DIR / "Input" / "trial_N50_T240_r175_eps012_008_03_0068_005.txt_kaneko"
+DEFAULT_REFERENCE = ROOT_DIR / "Sample_results" / "results_T0_1200_N50.txt"
+BACKENDS = ["numpy", "numba"]
+
+# The reference was computed by an older version of the code, whose sums may differ in the last digits
+REFERENCE_RTOL = 1e-9
+
+
+def run_backend(input_file: Path, t_init: int, t_end: int, ncores: int, backend: str, options: List[str],
+                edgeweight_file: Path) -> np.ndarray:
+    """Run the engine with one backend and return the indicators sorted by time (one row per frame)."""
+    args = [sys.executable, str(CODE_PATH), str(input_file), "-t", str(t_init), str(t_end),
+            "-p", str(ncores), "-e", backend, "-s", str(edgeweight_file)] + options
+    run = subprocess.run(args, cwd=CODE_PATH.parent, check=True, capture_output=True, text=True)
+    if "numba is not installed" in run.stderr:
+        sys.exit("numba is not installed: the numba backend cannot be validated")
+    results = np.array([[float(el) for el in line.split()] for line in run.stdout.splitlines() if line.strip()])
+    return results[np.argsort(results[:, 0])]
+
+
+def load_projections(edgeweight_file: Path) -> Dict[str, np.ndarray]:
+    """Return the projection on the edges saved for each time point."""
+    with h5py.File(f"{edgeweight_file}.hd5", "r") as f:
+        return {name: f[name][()] for name in f}
+
+
+def main():
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print(__doc__)
+        sys.exit(0)
+
+    positional, options = [], []
+    t_init, t_end, ncores = 0, 40, 1
+    args = sys.argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg == "-t":
+            t_init, t_end = int(args.pop(0)), int(args.pop(0))
+        elif arg == "-p":
+            ncores = int(args.pop(0))
+        elif arg.startswith("-"):
+            options.append(arg)
+            # (value of the option, if any)
+            while args and not args[0].startswith("-"):
+                options.append(args.pop(0))
+        else:
+            positional.append(Path(arg).resolve())
+    input_file = positional[0] if positional else DEFAULT_INPUT
+    reference_file = positional[1] if len(positional) > 1 else (None if positional else DEFAULT_REFERENCE)
+
+    results, projections = {}, {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for backend in BACKENDS:
+            edgeweight_file = Path(tmp_dir) / backend
+            results[backend] = run_backend(input_file, t_init, t_end, ncores, backend, options, edgeweight_file)
+            projections[backend] = load_projections(edgeweight_file)
+
+    print(f"numba vs numpy ({input_file.name}, t={t_init}..{t_end} {' '.join(options)}):")
+    same_indicators = np.array_equal(results["numba"], results["numpy"], equal_nan=True)
+    same_projections = projections["numba"].keys() == projections["numpy"].keys() and all(
+        np.array_equal(projections["numba"][name], projections["numpy"][name]) for name in projections["numpy"])
+    print(f"  {'Indicators':<24} {'identical' if same_indicators else 'DIFFERENT'}")
+    print(f"  {'Projections on the edges':<24} {'identical' if same_projections else 'DIFFERENT'}")
+    all_passed = same_indicators and same_projections
+
+    if reference_file is not None:
+        reference = np.loadtxt(reference_file)
+        reference = reference[np.argsort(reference[:, 0])]
+        reference = reference[(reference[:, 0] >= t_init) & (reference[:, 0] < t_end)]
+        for backend in BACKENDS:
+            rel_diff = np.max(np.abs(results[backend][:, :7] - reference) / np.maximum(np.abs(reference), np.finfo(float).tiny))
+            passed = bool(rel_diff <= REFERENCE_RTOL)
+            print(f"{backend} vs {reference_file.name}: max rel: {rel_diff:.3e}  {'OK' if passed else 'FAIL'}")
+            all_passed &= passed
+
+    sys.exit(0 if all_passed else 1)
+
+
+if __name__ == "__main__":
+    main()
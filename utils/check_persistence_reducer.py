@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Utility script to validate the built-in H1 persistence reducer of High_order_TS.
+
+For each frame, builds the filtration of simplicial_complex_mvts and computes the
+persistence diagram in dimension 1 both with the built-in reducer
+(compute_persistence_diagram) and with cechmate.phat_diagrams. The two diagrams
+must be identical (same points, in the same order). Also reports the time spent
+per frame by the two methods. With -l, the diagram of the large-N mode (triangles
+streamed in blocks, compute_persistence_diagram_streaming) is compared as well.
+
+Usage:
+    python check_persistence_reducer.py [<input_file>] [-t t0 T] [-n] [-f float32] [-l]
+
+Defaults:
+    input_file      Input/trial_N50_T240_r175_eps012_008_03_0068_005.txt_kaneko
+    -t 0 50
+"""
+
+import copy
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR / "High_order_TS"))
+from utils import (simplicial_complex_mvts, load_data,  # noqa: E402
+                   compute_persistence_diagram_cechmate)
+
+DEFAULT_INPUT = ROOT_DIR / "Input" / "trial_N50_T240_r175_eps012_008_03_0068_005.txt_kaneko"
+
+
+def main():
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print(__doc__)
+        sys.exit(0)
+
+    input_file = DEFAULT_INPUT
+    t_init, t_end, null_model_flag, dtype, large_N = 0, 50, False, np.float64, False
+    args = sys.argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg == "-t":
+            t_init, t_end = int(args.pop(0)), int(args.pop(0))
+        elif arg == "-n":
+            null_model_flag = True
+        elif arg == "-f":
+            dtype = np.dtype(args.pop(0)).type
+        elif arg == "-l":
+            large_N = True
+        else:
+            input_file = Path(arg).resolve()
+
+    ts_simplicial = simplicial_complex_mvts(load_data(str(input_file), dtype), null_model_flag, dtype=dtype)
+    if large_N:
+        # Same statistics (and same reshuffling of the null model), only the filtration is streamed
+        ts_large = copy.copy(ts_simplicial)
+        ts_large.large_N = True
+
+    mismatches, time_reducer, time_cechmate, time_streaming = [], 0.0, 0.0, 0.0
+    for t, (filtration, _, _) in zip(range(t_init, t_end), ts_simplicial.create_simplicial_complex_block(t_init, t_end)):
+        tic = time.perf_counter()
+        dgm1 = ts_simplicial.compute_persistence_diagram(filtration)[1]
+        time_reducer += time.perf_counter() - tic
+
+        tic = time.perf_counter()
+        dgm1_cechmate = compute_persistence_diagram_cechmate(ts_simplicial.list_of_simplices(filtration))[1]
+        time_cechmate += time.perf_counter() - tic
+
+        identical = np.array_equal(dgm1, dgm1_cechmate)
+        if large_N:
+            tic = time.perf_counter()
+            dgm1_streaming = ts_large.compute_persistence_diagram(ts_large.stream_triangles(t)[0])[1]
+            time_streaming += time.perf_counter() - tic
+            identical &= np.array_equal(dgm1, dgm1_streaming)
+        if not identical:
+            mismatches.append(t)
+
+    n_frames = t_end - t_init
+    print(f"{input_file.name}, t={t_init}..{t_end}: {n_frames - len(mismatches)}/{n_frames} identical diagrams")
+    print(f"  time per frame: reducer {1e3 * time_reducer / n_frames:.1f} ms, "
+          f"cechmate {1e3 * time_cechmate / n_frames:.1f} ms"
+          + (f", large-N (with the streaming) {1e3 * time_streaming / n_frames:.1f} ms" if large_N else ""))
+    if mismatches:
+        print(f"  mismatching frames: {mismatches}")
+    sys.exit(0 if not mismatches else 1)
+
+
+if __name__ == "__main__":
+    main()
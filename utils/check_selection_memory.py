@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Utility script to validate the first pass of the selection of the time points (-k) of High_order_TS.
+
+Runs the first pass (compute_coherence_block) on blocks of frames_per_block
+time points, as the Pool workers of -k do, under a small memory budget (-m),
+and measures with tracemalloc the peak of the memory allocated by each block.
+The peak must not exceed the budget. The hyper coherence and the average edge
+violation must be identical to the ones of the whole filtration
+(create_simplicial_complex_block, i.e. find_violations_block).
+
+Usage:
+    python check_selection_memory.py [<input_file>] [-t t0 T] [-r #ROI] [-m #MB]
+
+Defaults:
+    input_file      Input/subject1_left.txt
+    -t 0 80, -r 60, -m 20
+"""
+
+import sys
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR / "High_order_TS"))
+from utils import simplicial_complex_mvts, load_data, contiguous_blocks  # noqa: E402
+
+DEFAULT_INPUT = ROOT_DIR / "Input" / "subject1_left.txt"
+
+
+def reference_coherence(ts_simplicial, t_init, t_end):
+    """Return the hyper coherence and the average edge violation of the whole filtration of each time point."""
+    hyper_coherence, avg_edge_violation = [], []
+    for _, (_, _, missing_edges), coherence in ts_simplicial.create_simplicial_complex_block(t_init, t_end):
+        hyper_coherence.append(coherence)
+        avg_edge_violation.append(np.sum(missing_edges) / len(missing_edges) if len(missing_edges) else np.nan)
+    return np.array(hyper_coherence), np.array(avg_edge_violation)
+
+
+def main():
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print(__doc__)
+        sys.exit(0)
+
+    input_file = DEFAULT_INPUT
+    t_init, t_end, n_rois, memory_budget = 0, 80, 60, 20
+    args = sys.argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg == "-t":
+            t_init, t_end = int(args.pop(0)), int(args.pop(0))
+        elif arg == "-r":
+            n_rois = int(args.pop(0))
+        elif arg == "-m":
+            memory_budget = float(args.pop(0))
+        else:
+            input_file = Path(arg).resolve()
+
+    ts_simplicial = simplicial_complex_mvts(load_data(str(input_file)), False, memory_budget, rois=np.arange(n_rois))
+    block_size = ts_simplicial.frames_per_block()
+    max_peak, identical = 0, True
+    for t_block in contiguous_blocks(list(range(t_init, t_end)), block_size):
+        tracemalloc.start()
+        hyper_coherence, avg_edge_violation = ts_simplicial.compute_coherence_block(t_block[0], t_block[-1] + 1)
+        max_peak = max(max_peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        reference = reference_coherence(ts_simplicial, t_block[0], t_block[-1] + 1)
+        identical &= (np.array_equal(hyper_coherence, reference[0], equal_nan=True) and
+                      np.array_equal(avg_edge_violation, reference[1], equal_nan=True))
+
+    budget_passed = max_peak <= memory_budget * 1024**2
+    print(f"First pass of -k on {n_rois} ROI of {input_file.name}, t={t_init}..{t_end}, -m {memory_budget:g} "
+          f"({block_size} time points per block):")
+    print(f"  peak {max_peak / 1024**2:.1f} MB of {memory_budget:g} MB  {'OK' if budget_passed else 'FAIL'}")
+    print(f"  hyper coherence and average edge violation {'identical' if identical else 'DIFFERENT'} to the filtration")
+    sys.exit(0 if budget_passed and identical else 1)
+
+
+if __name__ == "__main__":
+    main()
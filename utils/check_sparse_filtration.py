@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Utility script to validate the approximate sparse mode (-x) of High_order_TS.
+
+Runs simplicial_multivariate.py on the same input once exactly and once for each
+sparse rule, and compares the indicators frame by frame. For each rule it reports
+the fraction of triangles dropped, the relative error of the hyper complexity,
+the width of the error bound written on stderr, how many frames have the exact
+value inside the bound, and the running times. Hyper coherence and average edge
+violation must be identical (they are computed on all the triangles).
+
+The bound is guaranteed for the exact Wasserstein distances (-w #p), while for the
+sliced one (default) it is an estimate.
+
+Usage:
+    python check_sparse_filtration.py [<input_file>] [-t t0 T] [-p #core] [-w #p] [-x <rule> #value ...]
+
+Defaults:
+    input_file      Input/subject1_left.txt
+    -t 0 20, -p 1, -x quantile 0.05 -x quantile 0.2 -x topk 6000
+"""
+
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent
+CODE_PATH = ROOT_DIR / "High_order_TS" / "simplicial_multivariate.py"
+DEFAULT_INPUT = ROOT_DIR / "Input" / "subject1_left.txt"
+DEFAULT_RULES = [("quantile", 0.05), ("quantile", 0.2), ("topk", 6000)]
+
+# Line written on stderr for each frame by the sparse mode
+SPARSE_LINE = re.compile(r"\[sparse\] t=(\d+): dropped (\d+) of (\d+) triangles, hyper complexity (\S+) >= (\S+)")
+
+
+def run_indicators(input_file: Path, t_init: int, t_end: int, ncores: int, extra_args: List[str]
+                   ) -> Tuple[np.ndarray, Optional[np.ndarray], float]:
+    """Run the engine and return the indicators and the sparse report sorted by time, and the running time."""
+    args = [sys.executable, str(CODE_PATH), str(input_file), "-t", str(t_init), str(t_end), "-p", str(ncores)] + extra_args
+    tic = time.perf_counter()
+    run = subprocess.run(args, cwd=CODE_PATH.parent, check=True, capture_output=True, text=True)
+    elapsed = time.perf_counter() - tic
+    results = np.array([[float(el) for el in line.split()] for line in run.stdout.splitlines() if line.strip()])
+    report = [[float(el) for el in match.groups()] for match in SPARSE_LINE.finditer(run.stderr)]
+    report = np.array(report)[np.argsort([row[0] for row in report])] if report else None
+    return(results[np.argsort(results[:, 0])], report, elapsed)
+
+
+def main():
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print(__doc__)
+        sys.exit(0)
+
+    input_file = DEFAULT_INPUT
+    t_init, t_end, ncores, order, rules = 0, 20, 1, None, []
+    args = sys.argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg == "-t":
+            t_init, t_end = int(args.pop(0)), int(args.pop(0))
+        elif arg == "-p":
+            ncores = int(args.pop(0))
+        elif arg == "-w":
+            order = args.pop(0)
+        elif arg == "-x":
+            rules.append((args.pop(0), float(args.pop(0))))
+        else:
+            input_file = Path(arg).resolve()
+    rules = rules or DEFAULT_RULES
+    order_args = ["-w", order] if order is not None else []
+
+    exact, _, time_exact = run_indicators(input_file, t_init, t_end, ncores, order_args)
+    print(f"{input_file.name}, t={t_init}..{t_end}, hyper complexity "
+          f"{'exact Wasserstein of order ' + order if order is not None else 'sliced Wasserstein (bound estimated)'}")
+    print(f"  exact run: {time_exact:.1f} s")
+
+    all_passed = True
+    for rule, value in rules:
+        sparse, report, time_sparse = run_indicators(input_file, t_init, t_end, ncores,
+                                                     order_args + ["-x", rule, f"{value:g}"])
+        # Hyper coherence and average edge violation are not approximated
+        exact_coherence = np.array_equal(sparse[:, 5:7], exact[:, 5:7], equal_nan=True)
+        dropped = report[:, 1] / report[:, 2]
+        error = (report[:, 3] - exact[:, 1]) / exact[:, 1]
+        bound = (report[:, 3] - report[:, 4]) / exact[:, 1]
+        inside = (report[:, 4] <= exact[:, 1] * (1 + 1e-12)) & (exact[:, 1] <= report[:, 3] * (1 + 1e-12))
+        print(f"  -x {rule} {value:g}: {time_sparse:.1f} s, dropped {100 * np.mean(dropped):.1f}% of the triangles")
+        print(f"    hyper complexity  rel. error mean {np.mean(error):.3e} max {np.max(error):.3e}, "
+              f"rel. bound mean {np.mean(bound):.3e}, exact inside the bound: {np.count_nonzero(inside)}/{len(inside)}")
+        print(f"    hyper coherence and average edge violation identical: {'OK' if exact_coherence else 'FAIL'}")
+        all_passed &= exact_coherence and (order is None or bool(np.all(inside)))
+
+    sys.exit(0 if all_passed else 1)
+
+
+if __name__ == "__main__":
+    main()
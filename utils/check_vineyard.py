@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Utility script to validate the vineyard updates of the temporal mode (-v) of High_order_TS.
+
+On the inputs of the repository the cost model of persistence_vineyard
+always falls back to the reduction of the default mode, so the updates with
+transpositions (R = D V kept reduced) never run. Here the reduction of the
+default mode is reported as infinitely expensive (forced_vineyard), so that
+R and V are built on the second frame and all the following frames are
+updated with transpositions (up to #swaps, then the frame falls back and R
+and V are built again). For each frame, the persistence diagram in dimension
+1 must be identical (same points, in the same order) to the one of
+compute_persistence_diagram. The vineyard with the real costs is compared
+as well.
+
+The updates are in pure python: use a few ROI (-r) and time points (-t).
+
+Usage:
+    python check_vineyard.py [<input_file>] [-t t0 T] [-r #ROI] [-v #swaps]
+
+Defaults:
+    input_file      Input/subject1_left.txt
+    -t 0 20, -r 12, -v 100000000
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR / "High_order_TS"))
+from utils import simplicial_complex_mvts, load_data, persistence_vineyard  # noqa: E402
+
+DEFAULT_INPUT = ROOT_DIR / "Input" / "subject1_left.txt"
+
+
+class forced_vineyard(persistence_vineyard):
+    """Vineyard whose reduction of the default mode costs infinitely more than an update or a decomposition."""
+
+    cost_reduction = property(lambda self: np.inf, lambda self, value: None)
+
+    def costs_estimate(self):
+        return (np.inf, 0.0)
+
+
+def compare(vineyard, ts_simplicial, t_init, t_end):
+    """Return the mismatching frames of the vineyard and the time it spent."""
+    mismatches, time_vineyard = [], 0.0
+    for t, (filtration, _, _) in zip(range(t_init, t_end), ts_simplicial.create_simplicial_complex_block(t_init, t_end)):
+        tic = time.perf_counter()
+        dgm1 = vineyard.compute_persistence_diagram(filtration)[1]
+        time_vineyard += time.perf_counter() - tic
+        if not np.array_equal(dgm1, ts_simplicial.compute_persistence_diagram(filtration)[1]):
+            mismatches.append(t)
+    return mismatches, time_vineyard
+
+
+def main():
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print(__doc__)
+        sys.exit(0)
+
+    input_file = DEFAULT_INPUT
+    t_init, t_end, n_rois, max_transpositions = 0, 20, 12, 100000000
+    args = sys.argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg == "-t":
+            t_init, t_end = int(args.pop(0)), int(args.pop(0))
+        elif arg == "-r":
+            n_rois = int(args.pop(0))
+        elif arg == "-v":
+            max_transpositions = int(args.pop(0))
+        else:
+            input_file = Path(arg).resolve()
+
+    ts_simplicial = simplicial_complex_mvts(load_data(str(input_file)), False, rois=np.arange(n_rois))
+    n_frames = t_end - t_init
+    print(f"Vineyard vs compute_persistence_diagram ({n_rois} ROI of {input_file.name}, t={t_init}..{t_end}, "
+          f"-v {max_transpositions}):")
+    all_passed = True
+    for name, vineyard_class in [("forced updates", forced_vineyard), ("cost model", persistence_vineyard)]:
+        vineyard = vineyard_class(ts_simplicial.num_ROI, ts_simplicial.ets_vertices, ts_simplicial.triplets_edges,
+                                  max_transpositions, ts_simplicial.compute_persistence_diagram, n_frames)
+        mismatches, time_vineyard = compare(vineyard, ts_simplicial, t_init, t_end)
+        passed = not mismatches
+        if vineyard_class is forced_vineyard:
+            # (the update path must have run)
+            passed &= vineyard.n_updates > 0
+        print(f"  {name:<16} {n_frames - len(mismatches)}/{n_frames} identical diagrams, updates {vineyard.n_updates}, "
+              f"fallbacks {vineyard.n_fallbacks} (R and V built {vineyard.n_decompositions} times), transpositions "
+              f"{vineyard.n_transpositions}, {1e3 * time_vineyard / n_frames:.1f} ms per frame  "
+              f"{'OK' if passed else 'FAIL'}")
+        if mismatches:
+            print(f"    mismatching frames: {mismatches}")
+        all_passed &= passed
+
+    sys.exit(0 if all_passed else 1)
+
+
+if __name__ == "__main__":
+    main()